@@ -0,0 +1,64 @@
+import holoviews as hv
+import panel as pn
+
+from visualization_tool.compare_view import CompareView
+from visualization_tool.flight import Flight
+from visualization_tool.image_selector import ImageSelector
+from visualization_tool.image_view import ImageView
+from visualization_tool.ortho_view import OrthoView
+
+hv.extension("bokeh")  # type: ignore
+
+
+class VisTool:
+    """All the views of one session of the app, `template` is what is served."""
+
+    def __init__(self):
+        self.flight = Flight()
+        self.ortho_view = OrthoView(flight=self.flight)
+        self.image_selector = ImageSelector(
+            flight=self.flight, ortho_view=self.ortho_view
+        )
+        self.image_view = ImageView(
+            flight=self.flight, image_selector=self.image_selector
+        )
+        self.compare_view = CompareView(study_site=self.flight.study_site)
+
+        gr = pn.GridSpec(sizing_mode="scale_width", nrows=10, ncols=2)
+
+        gr[0:10, 0:1] = (self.ortho_view.view * self.image_selector.view).opts(
+            framewise=True,
+            data_aspect=1,
+            responsive=True,
+            active_tools=["wheel_zoom"],
+            default_tools=["pan", "wheel_zoom", "reset"],
+            xaxis="bare",
+            yaxis="bare",
+        )
+
+        gr[0:10, 1:2] = self.image_view.view
+
+        app = pn.Tabs(
+            (
+                "Explore view",
+                gr,
+            ),
+            (
+                "Compare view",
+                self.compare_view.view,
+            ),
+        )
+
+        self.template = pn.template.BootstrapTemplate(
+            site="FLOWER",
+            sidebar=[
+                self.flight,
+                self.ortho_view.param,
+                self.image_selector.param,
+                self.image_view.param,
+                self.compare_view.param,
+                # ortho_view.view,
+            ],
+            title="Data Explorer",
+            main=app,
+        )
@@ -0,0 +1,195 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import holoviews as hv
+import numpy as np
+import param
+import rasterio
+from rasterio.errors import WindowError
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window, from_bounds
+from rasterio.windows import bounds as window_bounds
+
+import visualization_tool.database.database as db
+from visualization_tool.config import DATA_PATH
+from visualization_tool.ortho_io import find_ortho, open_ortho
+
+# Reads the orthos of all sessions, one pool for the whole server
+_executor = ThreadPoolExecutor(max_workers=4)
+
+
+class CompareView(param.Parameterized):
+    """Shows the orthos of multiple dates of a study site, linked to the same x/y range.
+    Only the visible window is read, at the overview matching the screen resolution, the
+    orthos of the different dates are read in parallel.
+    """
+
+    study_site = param.Selector(objects=db.get_study_sites(), allow_None=False)
+    dates = param.ListSelector(default=[], objects=[])
+    mode = param.Selector(objects=["Side by side", "Swipe"], default="Side by side")
+    swipe = param.Number(default=0.5, bounds=(0, 1), step=0.01)
+    # Maximum width/height in pixels of the windows read, roughly the screen resolution
+    max_pixels = param.Integer(default=1500, precedence=-1)
+
+    def __init__(self, **params):
+        super().__init__(**params)
+        self.ortho_paths: dict[str, Path] = {}
+        self.extent: tuple[float, float, float, float] | None = None
+        # Last requested window and the futures reading it for every date
+        self._windows: tuple[tuple, dict[str, Future]] | None = None
+        self.site_updated()
+
+    @param.depends("study_site", watch=True)
+    def site_updated(self):
+        self.ortho_paths = {}
+        for date in db.get_dates(self.study_site):
+            _, flight_path = db.get_flight_id_path(self.study_site, date)
+            ortho_path = find_ortho(DATA_PATH.joinpath(flight_path))
+            if ortho_path is not None:
+                self.ortho_paths[date] = ortho_path
+
+        # The union of all ortho bounds, used as initial range
+        bounds = [self._ortho_bounds(p) for p in self.ortho_paths.values()]
+        self.extent = (
+            (
+                min(b[0] for b in bounds),
+                min(b[1] for b in bounds),
+                max(b[2] for b in bounds),
+                max(b[3] for b in bounds),
+            )
+            if bounds != []
+            else None
+        )
+        self._windows = None
+
+        dates = list(self.ortho_paths)
+        self.param.dates.objects = dates
+        self.dates = dates[:2]
+
+    def _ortho_bounds(self, ortho_path: Path) -> tuple[float, float, float, float]:
+        with rasterio.open(ortho_path) as src:
+            if src.crs != "EPSG:3812":
+                with WarpedVRT(src, crs="EPSG:3812") as vrt:
+                    return tuple(vrt.bounds)
+            return tuple(src.bounds)
+
+    def read_visible(self, date: str, x_range, y_range) -> hv.RGB:
+        """Returns the visible window of the ortho of `date`, all dates are read in parallel."""
+        if self.extent is None:
+            return hv.RGB(np.zeros((2, 2, 3), dtype=np.uint8), bounds=(0, 0, 1, 1))
+
+        x_range = x_range or (self.extent[0], self.extent[2])
+        y_range = y_range or (self.extent[1], self.extent[3])
+        key = (tuple(x_range), tuple(y_range), tuple(self.dates))
+        if self._windows is None or self._windows[0] != key:
+            self._windows = (
+                key,
+                {
+                    d: _executor.submit(
+                        self._read_window, self.ortho_paths[d], x_range, y_range
+                    )
+                    for d in self.dates
+                },
+            )
+        img, bounds = self._windows[1][date].result()
+        return hv.RGB(img, bounds=bounds).relabel(f"{self.study_site} {date}")
+
+    def _read_window(
+        self, ortho_path: Path, x_range, y_range
+    ) -> tuple[np.ndarray, tuple]:
+        """Reads the window in EPSG:3812 at the coarsest overview still giving `max_pixels` pixels."""
+        left, right = x_range
+        bottom, top = y_range
+        with rasterio.open(ortho_path) as src:
+            gsd = src.res[0]
+            overviews = src.overviews(1)
+        # Picking the largest downsample factor that still gives enough pixels for the screen
+        decimation = max(right - left, top - bottom) / gsd / self.max_pixels
+        downsample = max([f for f in overviews if f <= decimation], default=0)
+
+        with open_ortho(ortho_path, downsample) as src:
+            if src.crs != "EPSG:3812":
+                with WarpedVRT(src, crs="EPSG:3812") as vrt:
+                    return _read_bounds(vrt, left, bottom, right, top, self.max_pixels)
+            return _read_bounds(src, left, bottom, right, top, self.max_pixels)
+
+    def swipe_overlay(self, x_range, y_range, swipe):
+        """Shows the first date with on top of it the second date, up to the swipe position."""
+        if len(self.dates) < 2:
+            return hv.Overlay([self.read_visible(self.dates[0], x_range, y_range)])
+
+        before = self.read_visible(self.dates[0], x_range, y_range)
+        after = self.read_visible(self.dates[1], x_range, y_range)
+        left, bottom, right, top = after.bounds.lbrt()
+        width = after.data.shape[1]
+        split = int(width * swipe)
+        x_split = left + (right - left) * split / max(1, width)
+        after = hv.RGB(after.data[:, :split], bounds=(left, bottom, x_split, top))
+        return (before * after * hv.VLine(x_split).opts(color="white")).relabel(
+            f"{self.study_site} {self.dates[0]} | {self.dates[1]}"
+        )
+
+    @param.depends("study_site", "dates", "mode")
+    def view(self):
+        if self.dates == []:
+            return hv.Div("No ortho available for this study site")
+
+        # A new stream for every layout, its source is the first plot it is attached to
+        range_stream = hv.streams.RangeXY()
+        opts = dict(
+            data_aspect=1,
+            responsive=True,
+            active_tools=["wheel_zoom"],
+            default_tools=["pan", "wheel_zoom", "reset"],
+            xaxis="bare",
+            yaxis="bare",
+        )
+        if self.mode == "Swipe":
+            return hv.DynamicMap(
+                self.swipe_overlay,
+                streams=[range_stream, hv.streams.Params(self, ["swipe"])],
+            ).opts(**opts)
+
+        # The plots share their axes, so panning one ortho pans all of them
+        return (
+            hv.Layout(
+                [
+                    hv.DynamicMap(
+                        partial(self.read_visible, date), streams=[range_stream]
+                    ).opts(**opts)
+                    for date in self.dates
+                ]
+            )
+            .opts(shared_axes=True)
+            .cols(2)
+        )
+
+
+def _read_bounds(
+    src, left, bottom, right, top, max_pixels: int
+) -> tuple[np.ndarray, tuple]:
+    """Reads the part of the bounds inside the ortho, resampled to at most `max_pixels` wide and high.
+    The resampling happens while reading, so orthos without (enough) overviews are never read in full resolution.
+    """
+    try:
+        window = (
+            from_bounds(left, bottom, right, top, src.transform)
+            .intersection(Window(0, 0, src.width, src.height))
+            .round_offsets()
+            .round_lengths()
+        )
+    except WindowError:
+        # Window completely outside the ortho
+        empty = np.zeros((2, 2, src.count), dtype=src.dtypes[0])
+        return empty, (left, bottom, right, top)
+
+    scale = max(1, window.width / max_pixels, window.height / max_pixels)
+    out_shape = (
+        src.count,
+        max(1, round(window.height / scale)),
+        max(1, round(window.width / scale)),
+    )
+    data = src.read(window=window, out_shape=out_shape)
+    # hv.RGB expects (height, width, bands)
+    return np.moveaxis(data, 0, -1), window_bounds(window, src.transform)
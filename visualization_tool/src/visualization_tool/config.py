@@ -1,6 +1,26 @@
+import os
+import tempfile
 from pathlib import Path
 
-DATABASE_PATH = Path(__file__).parent.joinpath("metadata.db")
+# The paths can be overridden with environment variables, e.g. to run the load test on a synthetic dataset
+DATABASE_PATH = Path(
+    os.environ.get(
+        "FLOWER_DATABASE_PATH", Path(__file__).parent.joinpath("metadata.db")
+    )
+)
+# Parquet export of the database, see database/catalog.py
+CATALOG_PATH = DATABASE_PATH.parent.joinpath("catalog")
+# Cached vegetation indices & masks computed from the orthos, see derived_layers.py
+DERIVED_LAYER_PATH = Path(__file__).parent.joinpath("derived_layers")
 
 # Path where dataset can be found in same folder structure as downloaded.
-DATA_PATH = Path("../FLOWER Dataset/")
+DATA_PATH = Path(os.environ.get("FLOWER_DATA_PATH", "../FLOWER Dataset/"))
+
+# Cache of decoded images & orthos shared by all processes of the app, see shared_cache.py
+# /dev/shm is kept in memory on Linux, elsewhere the temporary folder is used
+SHARED_CACHE_PATH = (
+    Path("/dev/shm/flower-cache")
+    if Path("/dev/shm").is_dir()
+    else Path(tempfile.gettempdir()).joinpath("flower-cache")
+)
+SHARED_CACHE_SIZE = 4 * 1024**3  # bytes
@@ -0,0 +1,336 @@
+"""
+Iterable loader over the dataset images for training ML models.
+
+The images can be read directly from the dataset (random file opens) or from tar shards created with
+`pack_shards`, which makes an epoch a sequential read of a few large files. The shards follow the
+WebDataset layout: every image is stored as `<key>.jpg` followed by its metadata as `<key>.json`.
+
+Example:
+    loader = ImageLoader(study_site="Muziekbos-block", camera="sony", batch_size=32, crop_size=512, scaling_factor=(1, 2))
+    for epoch in range(10):
+        loader.set_epoch(epoch)
+        for images, metadata in loader:
+            ...
+
+With a torch DataLoader, the loader already yields batches:
+    data_loader = DataLoader(loader, batch_size=None, num_workers=4, pin_memory=True)
+"""
+
+import io
+import itertools
+import json
+import math
+import os
+import random
+import tarfile
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from turbojpeg import TJPF_RGB, TurboJPEG
+
+import visualization_tool.database.database as db
+from visualization_tool.config import DATA_PATH
+
+try:
+    import torch
+    from torch.utils.data import IterableDataset, get_worker_info
+except ImportError:
+    torch = None
+    IterableDataset = object
+    get_worker_info = None
+
+# MCU (minimum coded unit) sizes per TurboJPEG subsampling, lossless crops must be aligned to those
+_MCU_WIDTH = (8, 16, 16, 8, 8, 32)
+_MCU_HEIGHT = (8, 8, 16, 8, 16, 8)
+
+
+def select_image_metadata(
+    study_site: str | None = None,
+    date: str | None = None,
+    camera: str | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+) -> list[dict]:
+    """Returns the metadata of the JPG images matching the filters, sorted by id."""
+    records = []
+    for row in db.select_images(study_site, date, camera, bbox):
+        record = dict(zip(db.SELECT_IMAGES_COLUMNS, row, strict=True))
+        # Only the JPGs are loaded
+        del record["raw_path"]
+        if record["jpg_path"] is not None:
+            records.append(record)
+    records.sort(key=lambda r: r["id"])
+    return records
+
+
+def pack_shards(
+    records: list[dict], output_dir: Path, shard_size: int = 1000
+) -> list[Path]:
+    """Packs the JPG images and their metadata in tar shards of `shard_size` images.
+    The JPGs are copied as is, without decoding. `records` are as returned by `select_image_metadata`.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    n_shards = math.ceil(len(records) / shard_size)
+
+    def write_shard(i: int) -> Path:
+        shard_path = output_dir / f"shard-{i:06d}.tar"
+        # Writing to a temporary file, so an interrupted run never leaves a truncated shard behind
+        tmp_path = shard_path.with_suffix(".tar.tmp")
+        with tarfile.open(tmp_path, "w") as tar:
+            for record in records[i * shard_size : (i + 1) * shard_size]:
+                key = f"{record['id']:08d}"
+                tar.add(DATA_PATH.joinpath(record["jpg_path"]), arcname=f"{key}.jpg")
+                metadata = json.dumps(record).encode()
+                info = tarfile.TarInfo(f"{key}.json")
+                info.size = len(metadata)
+                tar.addfile(info, io.BytesIO(metadata))
+        tmp_path.replace(shard_path)
+        return shard_path
+
+    # Shards are independent, so writing them in parallel hides the latency of the storage
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        return list(executor.map(write_shard, range(n_shards)))
+
+
+class ImageLoader(IterableDataset):
+    """Iterates over the decoded dataset images together with their metadata.
+
+    Images are read from the database selection (filtered by study site, date, camera and bbox) or
+    from the tar `shards` made by `pack_shards`. The work is split deterministically over
+    `world_size` processes (e.g. nodes or GPUs) and, when used inside a torch DataLoader, its workers.
+    Decoding happens in a thread pool, TurboJPEG releases the GIL while decoding.
+
+    When `batch_size` is set, batches are written into `num_buffers` reusable arrays of shape
+    (batch_size, crop_size, crop_size, 3), which requires a `crop_size`. A yielded batch array is thus
+    overwritten `num_buffers` batches later, copy it if it needs to live longer.
+    With `pin_memory`, those buffers are allocated in pinned memory (requires torch). This only happens
+    when iterating in the main process, DataLoader workers return their batches through ordinary shared
+    memory, use `DataLoader(pin_memory=True)` to pin those.
+
+    Every reader yields the same number of images, as distributed training hangs when one process
+    runs out of batches before the others. Like torch's DistributedSampler, the images (or shards) are
+    padded by wrapping around, so a few images are seen twice per epoch.
+    When torch is installed, this is a torch IterableDataset and can be passed to a DataLoader. The loader
+    already yields batches, so use `DataLoader(loader, batch_size=None)` to disable the automatic batching.
+    """
+
+    def __init__(
+        self,
+        study_site: str | None = None,
+        date: str | None = None,
+        camera: str | None = None,
+        bbox: tuple[float, float, float, float] | None = None,
+        shards: list[Path] | None = None,
+        batch_size: int | None = None,
+        crop_size: int = 0,
+        scaling_factor: tuple[int, int] | None = None,
+        shuffle: bool = False,
+        seed: int = 0,
+        rank: int = 0,
+        world_size: int = 1,
+        num_threads: int | None = None,
+        prefetch: int = 64,
+        num_buffers: int = 3,
+        pin_memory: bool = False,
+    ):
+        if batch_size is not None and crop_size <= 0:
+            raise ValueError("Batching requires a crop_size, images differ in size")
+        if pin_memory and torch is None:
+            raise ValueError("pin_memory requires torch to be installed")
+
+        self.shards = shards
+        self.records = (
+            select_image_metadata(study_site, date, camera, bbox)
+            if shards is None
+            else None
+        )
+        # Number of images per shard, needed to give every reader the same number of images
+        self.shard_sizes = (
+            [_count_tar(shard) for shard in shards] if shards is not None else None
+        )
+        self.batch_size = batch_size
+        self.crop_size = crop_size
+        self.scaling_factor = scaling_factor
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.num_threads = num_threads or min(16, os.cpu_count() or 1)
+        self.prefetch = prefetch
+        self.num_buffers = num_buffers
+        self.pin_memory = pin_memory
+        self.epoch = 0
+        self.turbojpeg = TurboJPEG()
+        self._buffers: list[np.ndarray] | None = None
+
+    def set_epoch(self, epoch: int):
+        """Sets the epoch, used to seed the shuffling so that every process shuffles the same way."""
+        self.epoch = epoch
+
+    def __len__(self) -> int:
+        """Number of images in the selection or the shards (over all processes)."""
+        if self.records is None:
+            return sum(self.shard_sizes)
+        return len(self.records)
+
+    def __iter__(self) -> Iterator:
+        samples = self._iter_encoded()
+        with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            decoded = self._iter_decoded(executor, samples)
+            if self.batch_size is None:
+                yield from decoded
+            else:
+                yield from self._iter_batches(decoded)
+
+    def _shard_index(self) -> tuple[int, int]:
+        """Returns (index, count) of this reader over all processes and DataLoader workers."""
+        worker_id, num_workers = 0, 1
+        if get_worker_info is not None:
+            info = get_worker_info()
+            if info is not None:
+                worker_id, num_workers = info.id, info.num_workers
+        return self.rank * num_workers + worker_id, self.world_size * num_workers
+
+    def _iter_encoded(self) -> Iterator[tuple]:
+        """Yields (callable returning the jpeg bytes, metadata) for the part of this reader."""
+        index, count = self._shard_index()
+        rng = random.Random(self.seed + self.epoch)
+        num_samples = math.ceil(len(self) / count)
+
+        if self.shards is None:
+            records = list(self.records)
+            if self.shuffle:
+                rng.shuffle(records)
+            records = _pad(records, num_samples * count)
+            for record in records[index::count]:
+                path = DATA_PATH.joinpath(record["jpg_path"])
+                yield (path.read_bytes, record)
+        else:
+            # The shards are distributed, not the images, so that every reader only reads sequentially.
+            # The shards differ in size, so every reader cycles over its shards until it has num_samples images
+            shards = [
+                (shard, size)
+                for shard, size in zip(self.shards, self.shard_sizes, strict=True)
+                if size > 0
+            ]
+            if self.shuffle:
+                rng.shuffle(shards)
+            shards = _pad(shards, math.ceil(len(shards) / count) * count)
+            own_shards = [shard for shard, _ in shards[index::count]]
+            samples = itertools.chain.from_iterable(
+                _iter_tar(shard) for shard in itertools.cycle(own_shards)
+            )
+            yield from itertools.islice(samples, num_samples)
+
+    def _iter_decoded(
+        self, executor: ThreadPoolExecutor, samples: Iterator
+    ) -> Iterator[tuple[np.ndarray, dict]]:
+        # Keeping a bounded number of decodes in flight, this bounds the memory while hiding the latency
+        pending: deque[Future] = deque()
+        for read, metadata in samples:
+            pending.append(executor.submit(self._load, read, metadata))
+            if len(pending) >= self.prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def _iter_batches(self, decoded: Iterator) -> Iterator[tuple[np.ndarray, list]]:
+        if self._buffers is None:
+            self._buffers = [self._allocate_buffer() for _ in range(self.num_buffers)]
+
+        n_batch = 0
+        buffer = self._buffers[0]
+        metadata = []
+        for image, meta in decoded:
+            buffer[len(metadata)] = image
+            metadata.append(meta)
+            if len(metadata) == self.batch_size:
+                yield buffer, metadata
+                n_batch += 1
+                buffer = self._buffers[n_batch % self.num_buffers]
+                metadata = []
+        if metadata:
+            # Last, incomplete batch
+            yield buffer[: len(metadata)], metadata
+
+    def _allocate_buffer(self) -> np.ndarray:
+        shape = (self.batch_size, self.crop_size, self.crop_size, 3)
+        # Pinning in a DataLoader worker fails when CUDA is initialized in the parent process,
+        # and the worker sends its batches back through non-pinned shared memory anyway
+        if self.pin_memory and get_worker_info() is None:
+            return torch.empty(shape, dtype=torch.uint8).pin_memory().numpy()
+        return np.empty(shape, dtype=np.uint8)
+
+    def _load(self, read, metadata: dict) -> tuple[np.ndarray, dict]:
+        return self.decode(read()), metadata
+
+    def decode(self, jpeg: bytes) -> np.ndarray:
+        """Decodes a JPG to RGB with the configured scaling and central crop (in output pixels)."""
+        if self.crop_size <= 0:
+            return self.turbojpeg.decode(
+                jpeg, pixel_format=TJPF_RGB, scaling_factor=self.scaling_factor
+            )
+
+        num, denom = self.scaling_factor or (1, 1)
+        width, height, subsample, _ = self.turbojpeg.decode_header(jpeg)
+        # Crop size and offset in the original resolution
+        crop = min(math.ceil(self.crop_size * denom / num), width, height)
+        x, y = (width - crop) // 2, (height - crop) // 2
+
+        # Lossless crop in the DCT domain, so we only decode the part we need.
+        # The crop has to start on a MCU boundary, so we crop a bit larger and cut the rest after decoding
+        x_aligned = x - x % _MCU_WIDTH[subsample]
+        y_aligned = y - y % _MCU_HEIGHT[subsample]
+        try:
+            jpeg = self.turbojpeg.crop(
+                jpeg,
+                x_aligned,
+                y_aligned,
+                min(crop + x - x_aligned, width - x_aligned),
+                min(crop + y - y_aligned, height - y_aligned),
+            )
+            x, y = x - x_aligned, y - y_aligned
+        except (OSError, ValueError):
+            # Some JPGs can't be transformed losslessly, decoding the full image
+            pass
+
+        img = self.turbojpeg.decode(
+            jpeg, pixel_format=TJPF_RGB, scaling_factor=self.scaling_factor
+        )
+        x, y = x * num // denom, y * num // denom
+        img = img[y : y + self.crop_size, x : x + self.crop_size]
+        if img.shape[:2] != (self.crop_size, self.crop_size):
+            raise ValueError(
+                f"Image is smaller than the crop size {self.crop_size} after scaling"
+            )
+        return img
+
+
+def _pad(items: list, length: int) -> list:
+    """Pads the list to `length` by wrapping around."""
+    if len(items) == 0:
+        return items
+    return list(itertools.islice(itertools.cycle(items), length))
+
+
+def _count_tar(shard: Path) -> int:
+    """Counts the images in a tar shard, only the headers are read."""
+    with tarfile.open(shard, "r:") as tar:
+        return sum(1 for name in tar.getnames() if name.endswith(".jpg"))
+
+
+def _iter_tar(shard: Path) -> Iterator[tuple]:
+    """Reads a tar shard sequentially, yields (callable returning the jpeg bytes, metadata)."""
+    jpeg = None
+    # Streaming mode, the shard is read once from start to end
+    with tarfile.open(shard, "r|") as tar:
+        for member in tar:
+            data = tar.extractfile(member).read()
+            if member.name.endswith(".jpg"):
+                jpeg = data
+            elif member.name.endswith(".json"):
+                metadata = json.loads(data)
+                yield ((lambda jpeg=jpeg: jpeg), metadata)
+                jpeg = None
@@ -0,0 +1,202 @@
+"""
+Columnar (Parquet) export of the metadata database.
+
+The catalog folder has the following structure:
+└── catalog
+    ├── flights.parquet
+    ├── cameras.parquet
+    └── images
+        └── study_site=Muziekbos-block
+            └── date=20220428
+                └── part-0.parquet
+
+The images table is denormalized (study site, date and camera name are added) and partitioned by
+study site and date, so external tools like DuckDB or polars can scan it directly, e.g.:
+    duckdb.sql("SELECT * FROM read_parquet('catalog/images/**/*.parquet', hive_partitioning=true)")
+The catalog is (re-)exported automatically when it is older than the database.
+"""
+
+import shutil
+import sqlite3
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+from visualization_tool.config import CATALOG_PATH, DATABASE_PATH
+from visualization_tool.file_lock import file_lock
+
+# Partition values like 20220428 would be inferred as integers otherwise
+_PARTITIONING = ds.partitioning(
+    pa.schema([("study_site", pa.string()), ("date", pa.string())]), flavor="hive"
+)
+_SQLITE_TYPES = {"INTEGER": pa.int64(), "REAL": pa.float64(), "TEXT": pa.string()}
+# Memory mapping the files makes reading zero-copy
+_FILESYSTEM = fs.LocalFileSystem(use_mmap=True)
+_LOCK_PATH = CATALOG_PATH.with_name(f".{CATALOG_PATH.name}.lock")
+
+_images_dataset: ds.Dataset | None = None
+_images_dataset_mtime: float | None = None
+
+
+def export_catalog(only_if_stale: bool = False):
+    """Exports the flights, cameras and images tables of the database to Parquet files in `CATALOG_PATH`.
+    The export is serialized over processes (e.g. `panel serve --num-procs`), with `only_if_stale` the
+    catalog is only exported if no other process exported it while waiting.
+    """
+    # Without file locks (Windows), concurrent exports are handled by the rename
+    with file_lock(_LOCK_PATH):
+        if only_if_stale and not catalog_is_stale():
+            return
+        _export_catalog()
+
+
+def _export_catalog():
+    print(f"Exporting metadata catalog to {CATALOG_PATH}...")
+    # Using a separate read-only connection, so the export doesn't depend on the app connection
+    conn = sqlite3.connect(f"file:{DATABASE_PATH}?mode=ro", uri=True)
+    try:
+        flights = _read_table(conn, "SELECT * FROM flights", _schema(conn, "flights"))
+        cameras = _read_table(conn, "SELECT * FROM cameras", _schema(conn, "cameras"))
+        images_schema = _schema(conn, "images")
+        for name in ("study_site", "date", "camera"):
+            images_schema = images_schema.append(pa.field(name, pa.string()))
+        images = _read_table(
+            conn,
+            """SELECT i.*, f.study_site, f.date, c.name AS camera
+                FROM images i
+                INNER JOIN flights f ON i.flight_id = f.id
+                INNER JOIN cameras c ON i.camera_id = c.id""",
+            images_schema,
+        )
+    finally:
+        conn.close()
+
+    # Writing to a temporary folder first, so readers never see a half written catalog
+    tmp_path = CATALOG_PATH.with_name(f".{CATALOG_PATH.name}-{uuid.uuid4().hex}")
+    tmp_path.mkdir(parents=True)
+    try:
+        pq.write_table(flights, tmp_path / "flights.parquet")
+        pq.write_table(cameras, tmp_path / "cameras.parquet")
+        ds.write_dataset(
+            images,
+            tmp_path / "images",
+            format="parquet",
+            partitioning=_PARTITIONING,
+            basename_template="part-{i}.parquet",
+        )
+        shutil.rmtree(CATALOG_PATH, ignore_errors=True)
+        tmp_path.rename(CATALOG_PATH)
+    except OSError:
+        # Without file locks, another process may have exported the catalog at the same time
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not CATALOG_PATH.exists():
+            raise
+
+
+def _schema(conn: sqlite3.Connection, table: str) -> pa.Schema:
+    """Arrow schema of a database table, based on the declared column types."""
+    return pa.schema(
+        [
+            (name, _SQLITE_TYPES.get(type_, pa.string()))
+            for _, name, type_, *_ in conn.execute(f"PRAGMA table_info({table})")
+        ]
+    )
+
+
+def _read_table(conn: sqlite3.Connection, sql: str, schema: pa.Schema) -> pa.Table:
+    rows = conn.execute(sql).fetchall()
+    columns = list(zip(*rows, strict=True)) if rows else [()] * len(schema)
+    return pa.Table.from_arrays(
+        [
+            pa.array(column, type=field.type)
+            for column, field in zip(columns, schema, strict=True)
+        ],
+        schema=schema,
+    )
+
+
+def catalog_is_stale() -> bool:
+    return (
+        not CATALOG_PATH.exists()
+        or CATALOG_PATH.stat().st_mtime < DATABASE_PATH.stat().st_mtime
+    )
+
+
+def images_dataset() -> ds.Dataset:
+    """Returns the Arrow dataset of the images, exporting the catalog first if it is stale."""
+    global _images_dataset, _images_dataset_mtime
+    if catalog_is_stale():
+        export_catalog(only_if_stale=True)
+    mtime = CATALOG_PATH.stat().st_mtime
+    if _images_dataset is None or mtime != _images_dataset_mtime:
+        _images_dataset = ds.dataset(
+            CATALOG_PATH / "images",
+            format="parquet",
+            partitioning=_PARTITIONING,
+            filesystem=_FILESYSTEM,
+        )
+        _images_dataset_mtime = mtime
+    return _images_dataset
+
+
+def read_images(
+    columns: list[str] | None = None,
+    study_site: str | None = None,
+    date: str | None = None,
+    camera: str | None = None,
+) -> pa.Table:
+    """Reads the images catalog as an Arrow table, None means no filtering.
+    Filters on study site and date only read the matching partitions.
+    """
+    expression = None
+    for name, value in (("study_site", study_site), ("date", date), ("camera", camera)):
+        if value is not None:
+            e = pc.field(name) == value
+            expression = e if expression is None else expression & e
+    return images_dataset().to_table(columns=columns, filter=expression)
+
+
+def load_image_coordinates(
+    study_site: str | None = None,
+    date: str | None = None,
+    camera: str | None = None,
+) -> pd.DataFrame:
+    """
+    Returns the image labels and epsg:3812 (ETRS89) coordinates as an Arrow-backed DataFrame
+    The DataFrame has the following columns: ['x', 'y', 'yaw' 'label', 'id'] (+ ['study_site', 'date', 'camera'] when not filtered on)
+    The positions from the CamPos file are preferred, the GPS positions from the EXIF are used as fallback.
+    """
+    table = read_images(
+        columns=[
+            "epsg3812_easting",
+            "gps_epsg3812_easting",
+            "epsg3812_northing",
+            "gps_epsg3812_northing",
+            "yaw",
+            "gimbal_yaw",
+            "label",
+            "id",
+            "study_site",
+            "date",
+            "camera",
+        ],
+        study_site=study_site,
+        date=date,
+        camera=camera,
+    )
+    columns = {
+        "x": pc.coalesce(table["epsg3812_easting"], table["gps_epsg3812_easting"]),
+        "y": pc.coalesce(table["epsg3812_northing"], table["gps_epsg3812_northing"]),
+        "yaw": pc.coalesce(table["yaw"], table["gimbal_yaw"]),
+        "label": table["label"],
+        "id": table["id"],
+    }
+    for name, value in (("study_site", study_site), ("date", date), ("camera", camera)):
+        if value is None:
+            columns[name] = table[name]
+    return pa.table(columns).to_pandas(types_mapper=pd.ArrowDtype)
@@ -25,9 +25,36 @@ CREATE TABLE images (
   epsg3812_northing REAL,
   altitude REAL,
   yaw REAL,
+  -- Metadata read from the EXIF/XMP headers of the image files
+  capture_time TEXT, -- ISO 8601, local time of the camera
+  gps_latitude REAL,
+  gps_longitude REAL,
+  gps_altitude REAL,
+  gps_epsg3812_easting REAL, -- GPS position transformed to EPSG:3812, fallback when no CamPos file is available
+  gps_epsg3812_northing REAL,
+  gimbal_yaw REAL,
+  exposure_time REAL, -- seconds
+  f_number REAL,
+  iso INTEGER,
+  image_width INTEGER,
+  image_height INTEGER,
   CONSTRAINT images_PK PRIMARY KEY (id),
   CONSTRAINT flight_id_FK FOREIGN KEY (flight_id) REFERENCES flights(id) ON DELETE SET NULL,
   CONSTRAINT camera_id_FK FOREIGN KEY (camera_id) REFERENCES cameras(id) ON DELETE SET NULL,
   UNIQUE(label, flight_id),
   UNIQUE(raw_path, jpg_path) -- One of those fields should be not null, they also both can be filled
 );
+
+CREATE TABLE file_integrity (
+  path TEXT NOT NULL, -- Relative to the data path
+  flight_id INTEGER NOT NULL,
+  kind TEXT NOT NULL, -- image, campos or ortho
+  size INTEGER, -- NULL when missing
+  mtime_ns INTEGER,
+  sha256 TEXT, -- NULL when not hashed yet
+  status TEXT NOT NULL, -- ok, warning, corrupt or missing
+  detail TEXT,
+  checked_at TEXT NOT NULL,
+  CONSTRAINT file_integrity_PK PRIMARY KEY (path),
+  CONSTRAINT flight_id_FK FOREIGN KEY (flight_id) REFERENCES flights(id) ON DELETE CASCADE
+);
@@ -1,8 +1,12 @@
 import sqlite3
+import threading
 from pathlib import Path
 
 from visualization_tool.config import DATA_PATH, DATABASE_PATH
-from visualization_tool.database.insert_image_metadata import ingest_metadata
+from visualization_tool.database.insert_image_metadata import (
+    ingest_metadata,
+    insert_image_headers,
+)
 
 
 class Singleton(type):
@@ -17,6 +21,9 @@ class Singleton(type):
 class _DBConnection(metaclass=Singleton):
     def __init__(self):
         self._conn: None | sqlite3.Connection = None
+        # The connection is shared by the threads of the server (`panel serve --num-threads`),
+        # queries are serialized with this lock. Reentrant, as the first query initializes the database
+        self.lock = threading.RLock()
 
     @property
     def conn(self) -> sqlite3.Connection:
@@ -27,7 +34,7 @@ class _DBConnection(metaclass=Singleton):
 
     def __create_connection(self):
         try:
-            c = sqlite3.connect(DATABASE_PATH)
+            c = sqlite3.connect(DATABASE_PATH, check_same_thread=False)
             print(
                 f"Opened SQLite database with version {sqlite3.sqlite_version} successfully."
             )
@@ -58,10 +65,49 @@ def init_database():
 
         # Inserting the data
         ingest_metadata()
+    else:
+        migrate_database()
 
     # TODO: Check if database is complete?
 
 
+def migrate_database():
+    """Adds the tables and columns missing in a database created with an older version of create_db.sql.
+    The image header columns are filled in by reading the headers of all images.
+    """
+    conn = _DBConnection().conn
+    # The declared schema is taken from a fresh in-memory database, so create_db.sql stays the only definition
+    schema = sqlite3.connect(":memory:")
+    schema.executescript((Path(__file__).parent / "create_db.sql").read_text())
+    tables = schema.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+    ).fetchall()
+    expected = schema.execute("PRAGMA table_info(images)").fetchall()
+    schema.close()
+
+    existing_tables = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+    }
+    for name, sql in tables:
+        if name not in existing_tables:
+            print(f"Migrating database, adding table: {name}")
+            conn.execute(sql)
+    conn.commit()
+
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(images)")}
+    missing = [(name, type_) for _, name, type_, *_ in expected if name not in existing]
+    if len(missing) == 0:
+        return
+
+    print(f"Migrating database, adding columns: {[name for name, _ in missing]}")
+    for name, type_ in missing:
+        conn.execute(f"ALTER TABLE images ADD COLUMN {name} {type_}")
+    conn.commit()
+    insert_image_headers()
+    conn.commit()
+
+
 ## Model classes
 class ImageMetadata:
     def __init__(
@@ -110,21 +156,23 @@ class ImageMetadata:
 
 
 def query(sql, params=()):
-    conn = _DBConnection().conn
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    conn.commit()
-    data = cur.fetchall()
-    cur.close()
+    with _DBConnection().lock:
+        conn = _DBConnection().conn
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        conn.commit()
+        data = cur.fetchall()
+        cur.close()
     return data
 
 
 def insert(sql, params):
-    conn = _DBConnection().conn
-    cur = conn.cursor()
-    cur.execute(sql, params)
-    conn.commit()
-    cur.close()
+    with _DBConnection().lock:
+        conn = _DBConnection().conn
+        cur = conn.cursor()
+        cur.execute(sql, params)
+        conn.commit()
+        cur.close()
     return cur.lastrowid
 
 
@@ -151,16 +199,51 @@ def get_cameras(site, date):
     return [t[0] for t in res]
 
 
-def get_camera_id(camera_name: str):
-    sql = """SELECT id FROM cameras WHERE name = ?"""
-    return query(sql, (camera_name,))[0][0]
-
-
-def get_flight_camera_image_coordinates(flight_id: int, camera_id: int):
-    sql = """SELECT epsg3812_easting, epsg3812_northing, yaw, label, id
-                 FROM images
-                 WHERE flight_id = ? AND camera_id = ?"""
-    return query(sql, (flight_id, camera_id))
+# Names of the columns returned by select_images
+SELECT_IMAGES_COLUMNS = [
+    "id",
+    "label",
+    "study_site",
+    "date",
+    "flight_path",
+    "camera",
+    "x",
+    "y",
+    "yaw",
+    "jpg_path",
+    "raw_path",
+]
+
+
+def select_images(
+    study_site: str | None = None,
+    date: str | None = None,
+    camera: str | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+):
+    """Selects the images matching all given filters, None means no filtering.
+    The bbox is (xmin, ymin, xmax, ymax) in epsg:3812 and only matches images with a known position.
+    Returns tuples with the columns of SELECT_IMAGES_COLUMNS, x and y are the easting and northing.
+    """
+    sql = """SELECT i.id, i.label, f.study_site, f.date, f.path, c.name,
+                    COALESCE(i.epsg3812_easting, i.gps_epsg3812_easting) AS easting,
+                    COALESCE(i.epsg3812_northing, i.gps_epsg3812_northing) AS northing,
+                    COALESCE(i.yaw, i.gimbal_yaw), i.jpg_path, i.raw_path
+            FROM images i
+            INNER JOIN flights f ON i.flight_id = f.id
+            INNER JOIN cameras c ON i.camera_id = c.id
+            WHERE (:study_site IS NULL OR f.study_site = :study_site)
+                AND (:date IS NULL OR f.date = :date)
+                AND (:camera IS NULL OR c.name = :camera)"""
+    params = {"study_site": study_site, "date": date, "camera": camera}
+    if bbox is not None:
+        sql += """
+                AND easting BETWEEN :xmin AND :xmax
+                AND northing BETWEEN :ymin AND :ymax"""
+        params.update(zip(("xmin", "ymin", "xmax", "ymax"), bbox, strict=True))
+    sql += """
+            ORDER BY f.study_site, f.date, c.name, i.label"""
+    return query(sql, params)
 
 
 def get_flight_id_path(study_site, date):
@@ -170,7 +253,11 @@ def get_flight_id_path(study_site, date):
 
 
 def get_image(id: int) -> ImageMetadata:
-    sql = """SELECT label, flight_id, camera_id, raw_path, jpg_path, epsg3812_easting, epsg3812_northing, altitude, yaw
+    sql = """SELECT label, flight_id, camera_id, raw_path, jpg_path,
+                    COALESCE(epsg3812_easting, gps_epsg3812_easting),
+                    COALESCE(epsg3812_northing, gps_epsg3812_northing),
+                    COALESCE(altitude, gps_altitude),
+                    COALESCE(yaw, gimbal_yaw)
                 FROM images WHERE id=?
             """
     res = query(sql, (id,))[0]
@@ -0,0 +1,144 @@
+import contextlib
+import os
+import re
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from PIL import ExifTags, Image
+
+# Columns of the images table that are filled in from the image headers
+HEADER_COLUMNS = [
+    "capture_time",
+    "gps_latitude",
+    "gps_longitude",
+    "gps_altitude",
+    "gimbal_yaw",
+    "exposure_time",
+    "f_number",
+    "iso",
+    "image_width",
+    "image_height",
+]
+
+# XMP is stored as plain text, DJI writes it as attribute or as element depending on the firmware
+_GIMBAL_YAW_RE = re.compile(
+    rb"GimbalYawDegree(?:\s*=\s*\"|>)\s*([+-]?\d+(?:\.\d+)?)", re.IGNORECASE
+)
+
+
+def read_image_header(path: Path | str) -> dict:
+    """Reads the EXIF/XMP metadata of a JPG/ARW/DNG image without decoding the pixels.
+    PIL only parses the headers on open, the pixel data is only read on `load()` which we never call.
+    Returns a dict with the `HEADER_COLUMNS` as keys, missing values are None.
+    """
+    header: dict = dict.fromkeys(HEADER_COLUMNS)
+    try:
+        with Image.open(path) as im:
+            header["image_width"], header["image_height"] = im.size
+            exif = im.getexif()
+            exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+            gps_ifd = exif.get_ifd(ExifTags.IFD.GPSInfo)
+            # JPEG stores XMP in an APP1 segment, TIFF based raw formats in the XMLPacket tag
+            xmp = im.info.get("xmp") or exif.get(ExifTags.Base.XMLPacket)
+    except Exception as e:
+        print(f"\033[93m\n Warning: Failed to read header of {path}: {e} \033[0m")
+        return header
+
+    # The raw formats have a thumbnail as first IFD, the real dimensions are in the Exif IFD
+    if ExifTags.Base.ExifImageWidth in exif_ifd:
+        header["image_width"] = int(exif_ifd[ExifTags.Base.ExifImageWidth])
+        header["image_height"] = int(exif_ifd[ExifTags.Base.ExifImageHeight])
+
+    date_time = exif_ifd.get(ExifTags.Base.DateTimeOriginal) or exif.get(
+        ExifTags.Base.DateTime
+    )
+    if date_time:
+        with contextlib.suppress(ValueError):
+            header["capture_time"] = datetime.strptime(
+                date_time.strip("\x00 "), "%Y:%m:%d %H:%M:%S"
+            ).isoformat()
+
+    header["exposure_time"] = _to_float(exif_ifd.get(ExifTags.Base.ExposureTime))
+    header["f_number"] = _to_float(exif_ifd.get(ExifTags.Base.FNumber))
+    iso = exif_ifd.get(ExifTags.Base.ISOSpeedRatings)
+    if isinstance(iso, tuple):
+        iso = iso[0] if len(iso) > 0 else None
+    header["iso"] = int(iso) if iso is not None else None
+
+    if gps_ifd:
+        header.update(_read_gps(gps_ifd))
+    if xmp:
+        header["gimbal_yaw"] = _read_gimbal_yaw(xmp)
+
+    return header
+
+
+def _read_gps(gps_ifd) -> dict:
+    altitude = _to_float(gps_ifd.get(ExifTags.GPS.GPSAltitude))
+    if altitude is not None and gps_ifd.get(ExifTags.GPS.GPSAltitudeRef) in (
+        1,
+        b"\x01",
+    ):
+        # Below sea level
+        altitude = -altitude
+    return {
+        "gps_latitude": _dms_to_degrees(
+            gps_ifd.get(ExifTags.GPS.GPSLatitude),
+            gps_ifd.get(ExifTags.GPS.GPSLatitudeRef),
+        ),
+        "gps_longitude": _dms_to_degrees(
+            gps_ifd.get(ExifTags.GPS.GPSLongitude),
+            gps_ifd.get(ExifTags.GPS.GPSLongitudeRef),
+        ),
+        "gps_altitude": altitude,
+    }
+
+
+def _read_gimbal_yaw(xmp: str | bytes) -> float | None:
+    if isinstance(xmp, str):
+        xmp = xmp.encode()
+    m = _GIMBAL_YAW_RE.search(xmp)
+    return float(m.group(1)) if m is not None else None
+
+
+def read_image_headers(
+    paths: Iterable[Path | str], max_workers: int | None = None
+) -> list[dict]:
+    """Reads the headers of all images in parallel, the result is in the same order as `paths`.
+    Reading the headers is mostly waiting on I/O and parsing, so we spread it over a process pool
+    to avoid being limited by the GIL.
+    """
+    paths = list(paths)
+    if len(paths) == 0:
+        return []
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) * 2)
+    # Large chunks keep the inter-process communication overhead low
+    chunksize = max(1, min(256, len(paths) // (max_workers * 4)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(read_image_header, paths, chunksize=chunksize))
+
+
+def _to_float(value) -> float | None:
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+
+
+def _dms_to_degrees(dms, ref) -> float | None:
+    """Converts an EXIF (degrees, minutes, seconds) tuple to decimal degrees."""
+    if dms is None or len(dms) != 3:
+        return None
+    try:
+        degrees = float(dms[0]) + float(dms[1]) / 60 + float(dms[2]) / 3600
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    if isinstance(ref, bytes):
+        ref = ref.decode(errors="ignore")
+    if ref in ("S", "W"):
+        degrees = -degrees
+    return degrees
@@ -1,11 +1,18 @@
 from pathlib import Path
 from typing import cast
 
+import numpy as np
 import pandas as pd
+from pyproj import Transformer
 from tqdm.auto import tqdm
 
 import visualization_tool.database.database as db
 from visualization_tool.config import DATA_PATH
+from visualization_tool.database.image_headers import (
+    HEADER_COLUMNS,
+    read_image_headers,
+)
+from visualization_tool.database.integrity import verify_dataset
 
 
 def ingest_metadata():
@@ -51,8 +58,15 @@ def ingest_metadata():
     for id, path in r:
         insert_image_positions(DATA_PATH.joinpath(path), id)
 
+    # Adding the EXIF/XMP metadata, also used as fallback position when there is no CamPos file
+    insert_image_headers()
+
     db._DBConnection().conn.commit()
 
+    # Fast structural check of the files, truncated downloads are reported here instead of failing when viewed.
+    # Hashing all files takes long, that is done by running the integrity module.
+    verify_dataset(hash_files=False)
+
 
 def check_insert_flight_and_camera(
     camera: str, study_site: str, date: str, flight_path: Path
@@ -182,5 +196,51 @@ def insert_image_positions(flight_path: Path, flight_id: int):
         print(f"\033[93m\n Warning: No camera positions found in {flight_path} \033[0m")
 
 
+def insert_image_headers():
+    """Reads the EXIF/XMP headers of all images in the database and stores them in the images table.
+    The GPS positions are transformed to EPSG:3812 in one batch so they can be used as fallback
+    positions for flights without CamPos file.
+    """
+    cur = db._DBConnection().conn.cursor()
+    # The JPG headers are preferred as they are faster to parse than the raw files
+    cur.execute("""SELECT id, COALESCE(jpg_path, raw_path) FROM images""")
+    rows = cur.fetchall()
+    if len(rows) == 0:
+        cur.close()
+        return
+
+    print(f"Reading headers of {len(rows)} images...")
+    headers = pd.DataFrame(
+        read_image_headers(DATA_PATH.joinpath(path) for _, path in rows),
+        columns=HEADER_COLUMNS,
+    )
+    headers["id"] = [id for id, _ in rows]
+
+    # Transforming the GPS coordinates to EPSG:3812 (ETRS89 / Belgian Lambert 2008) in one vectorized call
+    headers["gps_epsg3812_easting"] = np.nan
+    headers["gps_epsg3812_northing"] = np.nan
+    has_gps = headers[["gps_latitude", "gps_longitude"]].notna().all(axis=1)
+    if has_gps.any():
+        transformer = Transformer.from_crs("EPSG:4326", "EPSG:3812", always_xy=True)
+        easting, northing = transformer.transform(
+            headers.loc[has_gps, "gps_longitude"].to_numpy(dtype=float),
+            headers.loc[has_gps, "gps_latitude"].to_numpy(dtype=float),
+        )
+        headers.loc[has_gps, "gps_epsg3812_easting"] = easting
+        headers.loc[has_gps, "gps_epsg3812_northing"] = northing
+
+    columns = [*HEADER_COLUMNS, "gps_epsg3812_easting", "gps_epsg3812_northing"]
+    # NaN would be stored as a REAL, while it should be NULL
+    values = headers[[*columns, "id"]].astype(object)
+    values = values.where(values.notna(), None)
+    cur.executemany(
+        f"""UPDATE images
+            SET {", ".join(f"{c} = ?" for c in columns)}
+            WHERE id = ?""",
+        values.to_numpy().tolist(),
+    )
+    cur.close()
+
+
 if __name__ == "__main__":
     ingest_metadata()
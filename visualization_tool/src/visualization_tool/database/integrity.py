@@ -0,0 +1,305 @@
+"""
+Integrity checks of the downloaded dataset files (images, CamPos files and orthos).
+
+Every file gets a fast structural check (JPEG start/end markers, TIFF header, ortho overviews)
+and optionally a SHA-256 hash. The results are stored with the size and modification time of the
+file in the file_integrity table, so a next verification only checks the files that changed.
+
+Usage:
+    python -m visualization_tool.database.integrity [--no-hash] [--recheck]
+"""
+
+import argparse
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+import rasterio
+from rasterio.windows import Window
+from tqdm.auto import tqdm
+
+import visualization_tool.database.database as db
+from visualization_tool.config import DATA_PATH
+from visualization_tool.ortho_io import find_ortho
+
+_JPEG_SOI = b"\xff\xd8\xff"
+_JPEG_EOI = b"\xff\xd9"
+# Little/big endian TIFF and BigTIFF
+_TIFF_HEADERS = (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+")
+
+
+def check_file(path: Path, kind: str, hash_file: bool) -> dict:
+    """Checks the structure of a file and optionally hashes it, streaming it from disk once.
+    Returns a dict with the size, mtime_ns, sha256, status and detail of the file.
+    """
+    result = {"size": None, "mtime_ns": None, "sha256": None}
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return {**result, "status": "missing", "detail": "File not found"}
+    result["size"] = stat.st_size
+    result["mtime_ns"] = stat.st_mtime_ns
+
+    try:
+        with open(path, "rb") as f:
+            head = f.read(16)
+            if hash_file:
+                f.seek(0)
+                # Reads in chunks and releases the GIL, so hashing scales over threads
+                result["sha256"] = hashlib.file_digest(f, "sha256").hexdigest()
+            f.seek(max(0, stat.st_size - 1024))
+            tail = f.read()
+    except OSError as e:
+        return {**result, "status": "corrupt", "detail": f"Read error: {e}"}
+
+    status, detail = _check_structure(path, kind, head, tail)
+    return {**result, "status": status, "detail": detail}
+
+
+def _check_structure(
+    path: Path, kind: str, head: bytes, tail: bytes
+) -> tuple[str, str | None]:
+    suffix = path.suffix.lower()
+    if kind == "campos":
+        if len(head) == 0:
+            return "corrupt", "Empty file"
+        return "ok", None
+
+    if suffix in (".jpg", ".jpeg"):
+        if not head.startswith(_JPEG_SOI):
+            return "corrupt", "Missing JPEG start of image marker"
+        # Some cameras pad the file after the end of image marker
+        if not tail.rstrip(b"\x00\xff").endswith(_JPEG_EOI):
+            return "corrupt", "Missing JPEG end of image marker, truncated file?"
+        return "ok", None
+
+    if suffix in (".arw", ".dng", ".tif", ".tiff"):
+        if not head.startswith(_TIFF_HEADERS):
+            return "corrupt", "Invalid TIFF header"
+        if kind == "ortho":
+            return _check_ortho(path)
+        return "ok", None
+
+    return "ok", None
+
+
+def _check_ortho(path: Path) -> tuple[str, str | None]:
+    try:
+        with rasterio.open(path) as src:
+            # The last tile is at the end of the file, reading it detects truncated orthos
+            block_h, block_w = src.block_shapes[0]
+            row = (src.height - 1) // block_h * block_h
+            col = (src.width - 1) // block_w * block_w
+            window = Window(
+                col, row, min(block_w, src.width - col), min(block_h, src.height - row)
+            )
+            src.read(1, window=window)
+            if len(src.overviews(1)) == 0:
+                return "warning", "Ortho has no overviews, loading it will be slow"
+    except Exception as e:
+        # Besides RasterioIOError, GDAL raises various errors on damaged files (e.g. invalid tile offsets)
+        return "corrupt", f"Failed to read ortho: {e!r}"
+    return "ok", None
+
+
+def dataset_files() -> list[tuple[Path, int, str]]:
+    """Returns (path, flight_id, kind) of all files of the dataset that are recorded or expected.
+    Images listed in the CamPos file and orthos are expected, so they are reported missing when not downloaded.
+    """
+    images: dict[int, dict[str, tuple[str | None, str | None]]] = {}
+    for flight_id, label, jpg_path, raw_path in db.query(
+        "SELECT flight_id, label, jpg_path, raw_path FROM images"
+    ):
+        images.setdefault(flight_id, {})[label] = (jpg_path, raw_path)
+
+    files = []
+    for flight_id, flight_path in db.query("SELECT id, path FROM flights"):
+        flight_folder = DATA_PATH.joinpath(flight_path)
+        flight_images = images.get(flight_id, {})
+        for campos_file in sorted(flight_folder.glob("CamPos*.txt")):
+            files.append((campos_file, flight_id, "campos"))
+            # Expected next to the other images of the flight
+            image_folder = next(
+                (
+                    DATA_PATH.joinpath(jpg_path).parent
+                    for jpg_path, _ in flight_images.values()
+                    if jpg_path is not None
+                ),
+                flight_folder,
+            )
+            for label in _campos_labels(campos_file):
+                if label.split(".")[0] not in flight_images:
+                    files.append((image_folder / label, flight_id, "image"))
+
+        ortho_path = find_ortho(flight_folder)
+        # A flight without ortho is reported as a missing "Ortho*.tif"
+        files.append((ortho_path or flight_folder / "Ortho*.tif", flight_id, "ortho"))
+
+        for jpg_path, raw_path in flight_images.values():
+            for path in (jpg_path, raw_path):
+                if path is not None:
+                    files.append((DATA_PATH.joinpath(path), flight_id, "image"))
+    return files
+
+
+def _campos_labels(campos_file: Path) -> list[str]:
+    """Returns the image labels (with extension) of a CamPos file, parsed like the ingest does."""
+    try:
+        metadata = pd.read_table(campos_file, sep=",", skiprows=1)
+        return [str(label) for label in metadata["#Label"]]
+    except (OSError, ValueError, KeyError, UnicodeDecodeError):
+        # Unreadable CamPos files are reported by their own check
+        return []
+
+
+def verify_dataset(
+    hash_files: bool = True, recheck: bool = False, max_workers: int | None = None
+) -> dict[str, dict]:
+    """Verifies all dataset files and stores the results in the database.
+    Files of which the size and modification time didn't change since the last check are skipped,
+    unless `recheck` is set. Returns the report per flight, see `integrity_report`.
+    """
+    previous = {
+        path: (size, mtime_ns, sha256)
+        for path, size, mtime_ns, sha256 in db.query(
+            "SELECT path, size, mtime_ns, sha256 FROM file_integrity"
+        )
+    }
+
+    to_check = []
+    files = dataset_files()
+    rel_paths = {path.relative_to(DATA_PATH).as_posix() for path, _, _ in files}
+    for path, flight_id, kind in files:
+        rel_path = path.relative_to(DATA_PATH).as_posix()
+        if not recheck and rel_path in previous:
+            size, mtime_ns, sha256 = previous[rel_path]
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                stat = None
+            if (
+                stat is not None
+                and (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns)
+                and (sha256 is not None or not hash_files)
+            ):
+                continue
+        to_check.append((path, rel_path, flight_id, kind))
+
+    if len(to_check) > 0:
+        # Checking is I/O bound (and hashing releases the GIL), threads are enough
+        max_workers = max_workers or min(32, (os.cpu_count() or 1) * 4)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(
+                tqdm(
+                    executor.map(
+                        lambda f: check_file(f[0], f[3], hash_files), to_check
+                    ),
+                    total=len(to_check),
+                    desc="Verifying files",
+                )
+            )
+
+        checked_at = datetime.now().isoformat(timespec="seconds")
+        cur = db._DBConnection().conn.cursor()
+        cur.executemany(
+            """INSERT INTO file_integrity(path, flight_id, kind, size, mtime_ns, sha256, status, detail, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    flight_id = excluded.flight_id,
+                    kind = excluded.kind,
+                    size = excluded.size,
+                    mtime_ns = excluded.mtime_ns,
+                    sha256 = excluded.sha256,
+                    status = excluded.status,
+                    detail = excluded.detail,
+                    checked_at = excluded.checked_at""",
+            [
+                (
+                    rel_path,
+                    flight_id,
+                    kind,
+                    r["size"],
+                    r["mtime_ns"],
+                    _keep_hash(r, previous.get(rel_path)),
+                    r["status"],
+                    r["detail"],
+                    checked_at,
+                )
+                for (_, rel_path, flight_id, kind), r in zip(
+                    to_check, results, strict=True
+                )
+            ],
+        )
+        db._DBConnection().conn.commit()
+        cur.close()
+
+    # Files that are not expected anymore, e.g. the "Ortho*.tif" placeholder of a flight that got its ortho
+    stale = previous.keys() - rel_paths
+    if len(stale) > 0:
+        cur = db._DBConnection().conn.cursor()
+        cur.executemany(
+            "DELETE FROM file_integrity WHERE path = ?", [(p,) for p in stale]
+        )
+        db._DBConnection().conn.commit()
+        cur.close()
+
+    report = integrity_report()
+    print_report(report)
+    return report
+
+
+def _keep_hash(result: dict, previous: tuple | None) -> str | None:
+    """Keeps the previous hash of a file that wasn't hashed this time, but only if it didn't change."""
+    if result["sha256"] is not None or previous is None:
+        return result["sha256"]
+    size, mtime_ns, sha256 = previous
+    return sha256 if (result["size"], result["mtime_ns"]) == (size, mtime_ns) else None
+
+
+def integrity_report() -> dict[str, dict]:
+    """Returns per flight ("study_site date") the number of files per status and the problematic files."""
+    report: dict[str, dict] = {}
+    for study_site, date, status, path, detail in db.query(
+        """SELECT f.study_site, f.date, fi.status, fi.path, fi.detail
+            FROM file_integrity fi
+            INNER JOIN flights f ON fi.flight_id = f.id
+            ORDER BY f.study_site, f.date, fi.path"""
+    ):
+        flight = report.setdefault(
+            f"{study_site} {date}", {"counts": {}, "problems": []}
+        )
+        flight["counts"][status] = flight["counts"].get(status, 0) + 1
+        if status != "ok":
+            flight["problems"].append((path, status, detail))
+    return report
+
+
+def print_report(report: dict[str, dict]):
+    for flight, r in report.items():
+        counts = ", ".join(f"{n} {status}" for status, n in sorted(r["counts"].items()))
+        print(f"{flight}: {counts}")
+        for path, status, detail in r["problems"]:
+            color = "\033[93m" if status == "warning" else "\033[91m"
+            print(f"{color}  {status}: {path} ({detail})\033[0m")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verify the downloaded dataset files.")
+    parser.add_argument(
+        "--no-hash",
+        action="store_true",
+        help="Only do the structural checks, without hashing the files",
+    )
+    parser.add_argument(
+        "--recheck",
+        action="store_true",
+        help="Also check the files that didn't change since the last check",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    verify_dataset(
+        hash_files=not args.no_hash, recheck=args.recheck, max_workers=args.workers
+    )
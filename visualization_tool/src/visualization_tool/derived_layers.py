@@ -0,0 +1,258 @@
+"""
+Vegetation indices and masks computed from the RGB bands of the ortho.
+
+The layers are computed chunk by chunk with dask, with chunks aligned to the internal tiles of the
+ortho, so the full resolution ortho is never loaded in memory and all cores are used.
+A layer is computed from the ortho overview matching the downsample level of the view, optionally
+limited to a window, and cached as a Cloud Optimized GeoTIFF in `DERIVED_LAYER_PATH`, keyed by the
+ortho file, the layer, the downsample level and the window. Coarser views reuse the overviews of a
+layer that is already computed at a finer level.
+The computation runs in a background thread (`compute_layer_async`) so the server keeps responding,
+and a file lock makes sure the processes of `panel serve --num-procs` compute a layer only once.
+"""
+
+import threading
+import uuid
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import rasterio
+import rioxarray
+import xarray
+from rasterio.shutil import copy as rio_copy
+
+from visualization_tool.config import DERIVED_LAYER_PATH
+from visualization_tool.file_lock import file_lock
+from visualization_tool.shared_cache import content_key
+
+
+class Layer:
+    def __init__(
+        self,
+        formula: Callable[
+            [xarray.DataArray, xarray.DataArray, xarray.DataArray], xarray.DataArray
+        ],
+        vmin: float,
+        vmax: float,
+        mask: bool = False,
+    ):
+        """
+        formula: computes the layer from the R, G, B bands (float32, scaled to 0-1)
+        vmin, vmax: value range used for the colormap
+        mask: the layer is boolean
+        """
+        self.formula = formula
+        self.vmin = vmin
+        self.vmax = vmax
+        self.mask = mask
+
+
+def _chromatic(r, g, b):
+    # Chromatic coordinates, makes the indices less sensitive to the illumination
+    total = r + g + b
+    return r / total, g / total, b / total
+
+
+def _exg(r, g, b):
+    r, g, b = _chromatic(r, g, b)
+    return 2 * g - r - b
+
+
+LAYERS: dict[str, Layer] = {
+    # Excess Green
+    "ExG": Layer(_exg, vmin=-0.2, vmax=0.6),
+    # Visible Atmospherically Resistant Index
+    "VARI": Layer(lambda r, g, b: (g - r) / (g + r - b), vmin=-0.5, vmax=0.5),
+    # Green Leaf Index
+    "GLI": Layer(
+        lambda r, g, b: (2 * g - r - b) / (2 * g + r + b), vmin=-0.3, vmax=0.5
+    ),
+    # Vegetation mask, ExG above the threshold
+    "Vegetation mask": Layer(
+        lambda r, g, b: _exg(r, g, b) > 0.1, vmin=0, vmax=1, mask=True
+    ),
+}
+
+# Colormap (red - yellow - green) used to show the layers
+_COLORMAP_STOPS = np.array([0.0, 0.5, 1.0])
+_COLORMAP_RGB = np.array([[165, 0, 38], [255, 255, 191], [0, 104, 55]])
+
+# One layer at a time, dask already uses all cores for a layer
+_executor = ThreadPoolExecutor(max_workers=1)
+# Layers computed or being computed by this process
+_futures: dict[Path, Future] = {}
+_futures_lock = threading.Lock()
+
+
+def layer_path(
+    ortho_path: Path,
+    name: str,
+    downsample: int = 0,
+    bounds: tuple[float, float, float, float] | None = None,
+) -> Path:
+    """Path of the cached COG of the layer, see `compute_layer`."""
+    key = content_key(ortho_path, name, downsample, bounds)
+    return (
+        DERIVED_LAYER_PATH
+        / f"{ortho_path.stem}-{name.replace(' ', '_')}-{downsample}-{key[:16]}.tif"
+    )
+
+
+def compute_layer(
+    ortho_path: Path,
+    name: str,
+    downsample: int = 0,
+    bounds: tuple[float, float, float, float] | None = None,
+) -> Path:
+    """Computes the layer `name` from the ortho overview of the downsample factor (0 is full resolution),
+    optionally limited to bounds (xmin, ymin, xmax, ymax) in the crs of the ortho.
+    Returns the path of the cached COG, it is only computed when not cached yet.
+    """
+    path = layer_path(ortho_path, name, downsample, bounds)
+    if path.exists():
+        return path
+
+    DERIVED_LAYER_PATH.mkdir(parents=True, exist_ok=True)
+    with file_lock(path.with_suffix(".lock")):
+        # Another process may have computed it while we waited for the lock
+        if not path.exists():
+            _compute_layer(ortho_path, name, downsample, bounds, path)
+    return path
+
+
+def _compute_layer(
+    ortho_path: Path,
+    name: str,
+    downsample: int,
+    bounds: tuple[float, float, float, float] | None,
+    path: Path,
+):
+    print(f"Computing {name} layer of {ortho_path.name} (downsample {downsample})...")
+    layer = LAYERS[name]
+    with rasterio.open(ortho_path) as src:
+        overviews = src.overviews(1)
+    # chunks=True aligns the dask chunks to the internal tiles of the ortho
+    ortho = rioxarray.open_rasterio(
+        ortho_path,
+        chunks=True,
+        lock=False,
+        overview_level=(
+            overviews.index(downsample) if downsample not in (0, 1) else None
+        ),
+    )
+    assert type(ortho) is xarray.DataArray, (
+        "Ortho is not an xarray.DataArray, wrong ortho loaded?"
+    )
+    if bounds is not None:
+        ortho = ortho.rio.clip_box(*bounds)
+
+    r, g, b = (ortho.sel(band=i).astype(np.float32) / 255 for i in (1, 2, 3))
+    # Lazy, evaluated block by block when writing
+    values = layer.formula(r, g, b)
+    if ortho.sizes["band"] >= 4:
+        # Pixels outside the ortho are transparent
+        valid = ortho.sel(band=4) > 0
+    else:
+        valid = xarray.ones_like(r, dtype=bool)
+
+    if layer.mask:
+        values = values.astype(np.uint8).where(valid, 255).astype(np.uint8)
+        values = values.rio.write_nodata(255)
+    else:
+        values = values.where(valid & np.isfinite(values)).astype(np.float32)
+        values = values.rio.write_nodata(np.nan)
+    values = values.rio.write_crs(ortho.rio.crs)
+
+    # Writing a tiled GeoTIFF in parallel, then converting it to a COG which adds the overviews.
+    # The temporary files are unique, other threads or processes may compute the same layer
+    tmp_id = uuid.uuid4().hex
+    tmp_path = path.with_suffix(f".{tmp_id}.tmp.tif")
+    cog_path = path.with_suffix(f".{tmp_id}.cog.tif")
+    try:
+        values.rio.to_raster(
+            tmp_path,
+            tiled=True,
+            blockxsize=512,
+            blockysize=512,
+            compress="deflate",
+            lock=threading.Lock(),
+            compute=True,
+        )
+        rio_copy(
+            tmp_path,
+            cog_path,
+            driver="COG",
+            compress="deflate",
+            overview_resampling="nearest" if layer.mask else "average",
+        )
+        cog_path.replace(path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+        cog_path.unlink(missing_ok=True)
+
+
+def compute_layer_async(ortho_path: Path, name: str, downsample: int = 0) -> Future:
+    """Computes the layer of the full ortho in a background thread, see `compute_layer`.
+    Returns the future of the layer path, a layer is only computed once per process.
+    """
+    path = layer_path(ortho_path, name, downsample)
+    with _futures_lock:
+        future = _futures.get(path)
+        if future is None or (
+            future.done() and (future.exception() is not None or not path.exists())
+        ):
+            future = _executor.submit(compute_layer, ortho_path, name, downsample)
+            _futures[path] = future
+    return future
+
+
+def find_layer(
+    ortho_path: Path, name: str, downsample: int = 0
+) -> tuple[Path, int | None] | None:
+    """Finds a cached layer of the full ortho to show at the downsample factor.
+    Returns the path and overview level to open it with, None if the layer has to be computed first.
+    The layer computed at that factor is used, otherwise an overview of a layer computed at a finer factor.
+    """
+    with rasterio.open(ortho_path) as src:
+        factors = [1, *src.overviews(1)]
+    downsample = max(1, downsample)
+    for factor in sorted((f for f in factors if f <= downsample), reverse=True):
+        path = layer_path(ortho_path, name, factor if factor != 1 else 0)
+        if not path.exists():
+            continue
+        if factor == downsample:
+            return path, None
+        with rasterio.open(path) as src:
+            overviews = src.overviews(1)
+        if downsample // factor in overviews and downsample % factor == 0:
+            return path, overviews.index(downsample // factor)
+    return None
+
+
+def open_layer(layer_path: Path, overview_level: int | None = None) -> xarray.DataArray:
+    layer = rioxarray.open_rasterio(layer_path, overview_level=overview_level)
+    assert type(layer) is xarray.DataArray, (
+        "Layer is not an xarray.DataArray, wrong layer loaded?"
+    )
+    return layer
+
+
+def colorize(values: np.ndarray, name: str) -> np.ndarray:
+    """Maps a layer to RGBA (4, height, width) uint8 with a red-yellow-green colormap, nodata is transparent."""
+    layer = LAYERS[name]
+    rgba = np.empty((4, *values.shape), dtype=np.uint8)
+    # Colorizing by blocks of rows, so the float temporaries stay small for large layers
+    for start in range(0, values.shape[0], 512):
+        block = values[start : start + 512].astype(np.float32)
+        nodata = block == 255 if layer.mask else ~np.isfinite(block)
+        t = np.clip((block - layer.vmin) / (layer.vmax - layer.vmin), 0, 1)
+        t[nodata] = 0
+
+        for c in range(3):
+            rgba[c, start : start + 512] = np.interp(
+                t, _COLORMAP_STOPS, _COLORMAP_RGB[:, c]
+            )
+        rgba[3, start : start + 512] = np.where(nodata, 0, 255)
+    return rgba
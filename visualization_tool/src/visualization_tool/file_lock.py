@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, the callers then rely on atomic renames only
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path: Path):
+    """Exclusive lock over processes, held on the file at `path` (created if needed).
+    A no-op where fcntl is not available.
+    """
+    if fcntl is None:
+        yield
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
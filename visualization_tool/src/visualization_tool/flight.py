@@ -4,6 +4,7 @@ from pathlib import Path
 import pandas as pd
 import param
 
+import visualization_tool.database.catalog as catalog
 import visualization_tool.database.database as db
 from visualization_tool.config import DATA_PATH
 
@@ -68,10 +69,7 @@ class Flight(param.Parameterized):
 
     def fetch_image_coordinates(self) -> pd.DataFrame:
         """
-        Returns the image labels and epsg:3812 (ETRS89) coordinates as a DataFrame
+        Returns the image labels and epsg:3812 (ETRS89) coordinates as an Arrow-backed DataFrame
         The DataFrame has the following columns: ['x', 'y', 'yaw' 'label', 'id']
         """
-        camera_id = db.get_camera_id(self.camera)
-        result = db.get_flight_camera_image_coordinates(self.flight_id, camera_id)
-        df = pd.DataFrame(result, columns=["x", "y", "yaw", "label", "id"])
-        return df
+        return catalog.load_image_coordinates(self.study_site, self.date, self.camera)
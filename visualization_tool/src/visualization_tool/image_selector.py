@@ -41,16 +41,19 @@ class ImageSelector(param.Parameterized):
     @param.depends("flight.changed", "ortho_view.ortho_xmin")
     def update_pos_est_scatter(self):
         # print(self.flight.image_coordinates)
-        coords = self.flight.image_coordinates.dropna()
+        # Images without yaw (e.g. only a GPS fallback position) are shown without rotation
+        coords = self.flight.image_coordinates.dropna(subset=["x", "y"])
 
         return hv.Points(
             (
                 # centering coordinates to 0, see framewise issue in OrthoView class
-                coords.x - self.ortho_view.ortho_xmin,
-                coords.y - self.ortho_view.ortho_ymin,
-                -coords.yaw,  # we turn in goniometric direction
-                coords.label,
-                coords.id,
+                # The coordinates are Arrow-backed, converting them to numpy for the plotting
+                coords.x.to_numpy(dtype=float) - self.ortho_view.ortho_xmin,
+                coords.y.to_numpy(dtype=float) - self.ortho_view.ortho_ymin,
+                # we turn in goniometric direction
+                -coords.yaw.fillna(0).to_numpy(dtype=float),
+                coords.label.to_numpy(dtype=object),
+                coords.id.to_numpy(dtype=int),
             ),
             kdims=["x", "y"],
             vdims=["yaw", "label", "id"],
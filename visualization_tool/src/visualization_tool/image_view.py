@@ -8,6 +8,7 @@ from turbojpeg import TJPF_RGB, TurboJPEG
 import visualization_tool.database.database as db
 from visualization_tool.flight import Flight
 from visualization_tool.image_selector import ImageSelector
+from visualization_tool.shared_cache import content_key, shared_cache
 
 
 class ImageView(param.Parameterized):
@@ -47,8 +48,11 @@ class ImageView(param.Parameterized):
         jpg_path = self.image_metadata.jpg_path
 
         if jpg_path is not None:
-            with open(jpg_path, "rb") as f:
-                img = self.turbojpeg.decode(f.read(), pixel_format=TJPF_RGB)
+            # Decoded images are shared with the other processes serving the app
+            img = shared_cache.get_or_load(
+                content_key(jpg_path, "rgb"),
+                lambda: {"image": self.decode_jpg(jpg_path)},
+            )["image"]
         elif self.image_metadata.raw_path is not None:
             print("Error: image has not JPG path, loading raw files not yet supported")
         else:
@@ -58,6 +62,10 @@ class ImageView(param.Parameterized):
 
         self.image = img
 
+    def decode_jpg(self, jpg_path) -> np.ndarray:
+        with open(jpg_path, "rb") as f:
+            return self.turbojpeg.decode(f.read(), pixel_format=TJPF_RGB)
+
     @param.depends("image", "rotate_north", "crop_size")
     def update_img_plot(self):
         if self.image is not None:
@@ -68,7 +76,8 @@ class ImageView(param.Parameterized):
                 img = self.image
                 central_crop = False
 
-            if self.rotate_north:
+            # The yaw is unknown for images without CamPos position or gimbal yaw
+            if self.rotate_north and self.image_metadata.yaw_est is not None:
                 img = np.array(
                     Image.fromarray(img).rotate(
                         -self.image_metadata.yaw_est, expand=True
@@ -103,3 +112,11 @@ class ImageView(param.Parameterized):
     @property
     def view(self):
         return rasterize(self.image_dmap)
+
+
+def get_central_crop(img: np.ndarray, crop_size: int) -> np.ndarray:
+    """Returns the central crop_size x crop_size part of the image, limited to the image size."""
+    h, w = img.shape[:2]
+    crop_h, crop_w = min(crop_size, h), min(crop_size, w)
+    y, x = (h - crop_h) // 2, (w - crop_w) // 2
+    return img[y : y + crop_h, x : x + crop_w]
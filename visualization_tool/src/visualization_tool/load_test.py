@@ -0,0 +1,390 @@
+"""
+Load test of the app, to find how many concurrent users one server can handle.
+
+Every simulated session builds the full app (`VisTool`) and renders it to its own Bokeh document,
+like `panel serve` does when a browser connects. The sessions then randomly drive the same parameters
+a user would: changing the flight, tapping images, rotating/cropping the image and changing the ortho
+downsample level. The actions of all sessions are executed by `--threads` threads, like the threads of
+the server (1 by default, like `panel serve` without `--num-threads`), so the latency includes the time
+an action waits for the server. The browser and network are not included.
+The run fails when any action raises, or when a param/holoviews callback fails during an action (those
+are only logged as param warnings), the latencies of failing actions would be misleading.
+
+Usage (from the visualization_tool directory):
+    python -m visualization_tool.load_test --sessions 20 --duration 60
+    python -m visualization_tool.load_test --synthetic --sessions 20  # On a generated dataset
+"""
+
+import argparse
+import gc
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+SYNTHETIC_SITES = ("Synthetic/block", "Synthetic/sinus")
+SYNTHETIC_DATES = ("20240501", "20240615")
+# Lambert 2008 coordinates of the synthetic orthos
+SYNTHETIC_ORIGIN = (650_000.0, 670_000.0)
+
+
+def create_synthetic_dataset(
+    root: Path, n_images: int = 200, image_size=(2048, 1536), ortho_size: int = 4096
+):
+    """Creates a dataset with the same folder structure as the downloaded dataset, with random
+    JPGs, CamPos files and orthos (with overviews) for every synthetic site and date.
+    """
+    import rasterio
+    from rasterio.transform import from_origin
+    from rasterio.windows import Window
+    from turbojpeg import TurboJPEG
+
+    turbojpeg = TurboJPEG()
+    rng = np.random.default_rng(0)
+    # A few distinct images, copied to all files, the decoding cost is the same
+    w, h = image_size
+    jpgs = [
+        turbojpeg.encode(
+            rng.integers(0, 255, size=(h // 16, w // 16, 3), dtype=np.uint8)
+            .repeat(16, axis=0)
+            .repeat(16, axis=1),
+            quality=90,
+        )
+        for _ in range(8)
+    ]
+    gsd = 0.02
+    extent = ortho_size * gsd
+
+    for site in SYNTHETIC_SITES:
+        for date in SYNTHETIC_DATES:
+            location, pattern = site.split("/")
+            flight_folder = root / location / date / pattern
+            jpg_folder = flight_folder / "sony" / "JPG"
+            jpg_folder.mkdir(parents=True, exist_ok=True)
+
+            xs = SYNTHETIC_ORIGIN[0] + rng.uniform(0, extent, n_images)
+            ys = SYNTHETIC_ORIGIN[1] + rng.uniform(0, extent, n_images)
+            lines = ["# Synthetic camera positions", "#Label,X_est,Y_est,Z_est,Yaw_est"]
+            for i in range(n_images):
+                label = f"DSC{i:05d}"
+                (jpg_folder / f"{label}.JPG").write_bytes(jpgs[i % len(jpgs)])
+                lines.append(f"{label}.JPG,{xs[i]},{ys[i]},30.0,{rng.uniform(0, 360)}")
+            (flight_folder / "CamPos.txt").write_text("\n".join(lines))
+
+            ortho_path = flight_folder / f"Ortho_{location}_{pattern}_{date}.tif"
+            with rasterio.open(
+                ortho_path,
+                "w",
+                driver="GTiff",
+                width=ortho_size,
+                height=ortho_size,
+                count=4,
+                dtype="uint8",
+                crs="EPSG:3812",
+                transform=from_origin(
+                    SYNTHETIC_ORIGIN[0], SYNTHETIC_ORIGIN[1] + extent, gsd, gsd
+                ),
+                tiled=True,
+                blockxsize=512,
+                blockysize=512,
+                compress="deflate",
+            ) as dst:
+                # Writing tile by tile to keep the memory low
+                for row in range(0, ortho_size, 512):
+                    for col in range(0, ortho_size, 512):
+                        tile = np.empty((4, 512, 512), dtype=np.uint8)
+                        tile[:3] = rng.integers(0, 255, size=(3, 1, 1), dtype=np.uint8)
+                        tile[3] = 255
+                        dst.write(tile, window=Window(col, row, 512, 512))
+                dst.build_overviews([2, 4, 8, 16])
+
+
+def _change_site(app, rng):
+    app.flight.study_site = rng.choice(app.flight.param.study_site.objects)
+
+
+def _change_date(app, rng):
+    app.flight.date = rng.choice(app.flight.param.date.objects)
+
+
+def _change_camera(app, rng):
+    app.flight.camera = rng.choice(app.flight.param.camera.objects)
+
+
+def _tap_image(app, rng):
+    n = len(app.flight.image_coordinates.dropna())
+    if n > 0:
+        app.image_selector.selected_img_stream.event(index=[rng.randrange(n)])
+
+
+def _toggle_rotate_north(app, rng):
+    app.image_view.rotate_north = not app.image_view.rotate_north
+
+
+def _change_crop_size(app, rng):
+    app.image_view.crop_size = rng.choice([0, 256, 512, 1024])
+
+
+def _change_overview_level(app, rng):
+    # Flights without ortho have no overview levels
+    levels = app.ortho_view.param.overview_level.objects
+    if levels != []:
+        app.ortho_view.overview_level = rng.choice(levels)
+
+
+# Actions with their relative frequency, tapping images is what users do most
+ACTIONS = {
+    "flight.study_site": (_change_site, 1),
+    "flight.date": (_change_date, 1),
+    "flight.camera": (_change_camera, 1),
+    "image_selector.tap": (_tap_image, 6),
+    "image_view.rotate_north": (_toggle_rotate_north, 2),
+    "image_view.crop_size": (_change_crop_size, 2),
+    "ortho_view.overview_level": (_change_overview_level, 1),
+}
+
+
+# The param/holoviews callbacks (e.g. rendering a DynamicMap) don't raise, param logs a warning like
+# 'Callable raised "ValueError(...)"' and the plot keeps its previous state. The warnings are
+# collected per thread, so they fail the action of the session that caused them.
+_callback_errors = threading.local()
+
+
+class _CallbackErrorHandler(logging.Handler):
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+
+    def emit(self, record: logging.LogRecord):
+        messages = getattr(_callback_errors, "messages", None)
+        if messages is not None:
+            messages.append(f"{record.name}: {record.getMessage().splitlines()[0]}")
+
+
+@contextmanager
+def _raise_callback_errors():
+    """Raises a RuntimeError when a param/holoviews callback failed in the block, see `_callback_errors`."""
+    _callback_errors.messages = []
+    try:
+        yield
+    finally:
+        messages = _callback_errors.messages
+        _callback_errors.messages = None
+    if len(messages) > 0:
+        raise RuntimeError(f"Callback failed: {messages[0]}")
+
+
+class Session:
+    """A simulated user session, the app rendered to its own Bokeh document."""
+
+    def __init__(self, seed: int):
+        from bokeh.document import Document
+        from panel.io.state import set_curdoc
+
+        from visualization_tool.app import VisTool
+
+        self.rng = random.Random(seed)
+        self.doc = Document()
+        with set_curdoc(self.doc), _raise_callback_errors():
+            self.app = VisTool()
+            self.app.template.server_doc(self.doc)
+
+    def run(self, name: str):
+        from panel.io.state import set_curdoc
+
+        with set_curdoc(self.doc), _raise_callback_errors():
+            ACTIONS[name][0](self.app, self.rng)
+
+
+def run_load_test(
+    n_sessions: int, duration: float, think_time: float, threads: int, seed: int = 0
+) -> dict:
+    """Runs `n_sessions` sessions for `duration` seconds, every session waits on average
+    `think_time` seconds between its actions. Returns the latency, throughput and memory results.
+    The memory per session is the growth of the RSS over the run (creating the sessions and running their
+    actions, which fills their caches and plots), divided by the number of sessions.
+    """
+    import param
+
+    handler = _CallbackErrorHandler()
+    param.get_logger().addHandler(handler)
+    try:
+        return _run_load_test(n_sessions, duration, think_time, threads, seed)
+    finally:
+        param.get_logger().removeHandler(handler)
+
+
+def _warm_up(seed: int, count_error: Callable[[str, Exception], None]):
+    """Runs every action once in a session that is thrown away afterwards, so the imports, the database
+    connection and the module level state are not counted in the memory per session.
+    """
+    session = Session(seed)
+    for name in ACTIONS:
+        try:
+            session.run(name)
+        except Exception as e:
+            count_error(name, e)
+    del session
+    gc.collect()
+
+
+def _run_load_test(
+    n_sessions: int, duration: float, think_time: float, threads: int, seed: int
+) -> dict:
+    errors: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def count_error(name: str, e: Exception):
+        print(f"\033[91m Error in {name}: {e!r} \033[0m")
+        with lock:
+            errors[name] = errors.get(name, 0) + 1
+
+    _warm_up(seed - 1, count_error)
+
+    rss_start = _rss_mb()
+    sessions = []
+    for i in range(n_sessions):
+        sessions.append(Session(seed + i))
+        print(f"Created session {i + 1}/{n_sessions}, RSS: {_rss_mb():.0f} MB")
+    rss_sessions = _rss_mb()
+
+    latencies: dict[str, list[float]] = {name: [] for name in ACTIONS}
+    names = list(ACTIONS)
+    weights = [ACTIONS[name][1] for name in names]
+    # The server threads, executing the actions of all sessions
+    executor = ThreadPoolExecutor(max_workers=threads)
+    start = time.perf_counter()
+    end = start + duration
+
+    def user(session: Session):
+        # Every user waits, acts and waits for the result, like a user in the browser would
+        while True:
+            time.sleep(session.rng.expovariate(1 / think_time))
+            if time.perf_counter() >= end:
+                return
+            name = session.rng.choices(names, weights)[0]
+            scheduled = time.perf_counter()
+            try:
+                executor.submit(session.run, name).result()
+            except Exception as e:
+                count_error(name, e)
+                continue
+            with lock:
+                latencies[name].append(time.perf_counter() - scheduled)
+
+    users = [threading.Thread(target=user, args=(s,)) for s in sessions]
+    for u in users:
+        u.start()
+    for u in users:
+        u.join()
+    executor.shutdown()
+    elapsed = time.perf_counter() - start
+
+    if errors:
+        # The latencies of a run with failing actions are meaningless
+        raise RuntimeError(f"{sum(errors.values())} actions failed: {errors}")
+
+    all_latencies = [t for ts in latencies.values() for t in ts]
+    rss_end = _rss_mb()
+    return {
+        "sessions": n_sessions,
+        "threads": threads,
+        "duration_s": elapsed,
+        "actions": len(all_latencies),
+        "throughput_actions_per_s": len(all_latencies) / elapsed,
+        "latency_ms": {
+            name: _percentiles(ts)
+            for name, ts in [*latencies.items(), ("all", all_latencies)]
+            if ts != []
+        },
+        "memory_mb": {
+            "rss_start": rss_start,
+            "rss_after_sessions": rss_sessions,
+            "rss_end": rss_end,
+            "per_session": (rss_end - rss_start) / max(1, n_sessions),
+        },
+    }
+
+
+def print_results(results: dict):
+    print(
+        f"\n{results['sessions']} sessions, {results['threads']} server thread(s), "
+        f"{results['duration_s']:.1f}s: {results['actions']} actions, "
+        f"{results['throughput_actions_per_s']:.2f} actions/s"
+    )
+    print(f"{'action':28} {'count':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}")
+    for name, p in results["latency_ms"].items():
+        print(
+            f"{name:28} {p['count']:>6} {p['p50']:>7.0f}ms {p['p90']:>7.0f}ms "
+            f"{p['p99']:>7.0f}ms {p['max']:>7.0f}ms"
+        )
+    m = results["memory_mb"]
+    print(
+        f"RSS: {m['rss_start']:.0f} MB at start, {m['rss_after_sessions']:.0f} MB after creating the "
+        f"sessions, {m['rss_end']:.0f} MB at the end ({m['per_session']:.1f} MB/session)"
+    )
+
+
+def _percentiles(latencies: list[float]) -> dict:
+    ms = np.array(latencies) * 1000
+    return {
+        "count": len(ms),
+        "p50": float(np.percentile(ms, 50)),
+        "p90": float(np.percentile(ms, 90)),
+        "p99": float(np.percentile(ms, 99)),
+        "max": float(ms.max()),
+    }
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024**2
+    except OSError:
+        # Not on Linux, only the peak memory is available
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the app.")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60, help="seconds")
+    parser.add_argument(
+        "--think-time",
+        type=float,
+        default=2,
+        help="Mean time in seconds a user waits between actions",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=1, help="Number of threads of the server"
+    )
+    parser.add_argument(
+        "--synthetic",
+        action="store_true",
+        help="Run on a generated dataset instead of the configured one",
+    )
+    parser.add_argument("--json", type=Path, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        root = Path(tempfile.mkdtemp(prefix="flower-load-test-"))
+        print(f"Creating synthetic dataset in {root}...")
+        create_synthetic_dataset(root / "dataset")
+        # Has to be set before the app is imported, the config is read on import
+        os.environ["FLOWER_DATA_PATH"] = str(root / "dataset")
+        os.environ["FLOWER_DATABASE_PATH"] = str(root / "metadata.db")
+
+    results = run_load_test(args.sessions, args.duration, args.think_time, args.threads)
+    print_results(results)
+    if args.json is not None:
+        args.json.write_text(json.dumps(results, indent=2))
@@ -0,0 +1,55 @@
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+
+def find_ortho(flight_folder: Path) -> Path | None:
+    """Returns the path of the ortho in the flight folder, None if there is no ortho."""
+    r = sorted(flight_folder.glob("Ortho*.tif"))
+    if len(r) > 1:
+        print(
+            "\033[93m\n Warning: More than one ortho found in flight folder, the first one will be selected\033[0m"
+        )
+    return r[0] if r != [] else None
+
+
+def open_ortho(ortho_path: Path, downsample: int = 0) -> rasterio.DatasetReader:
+    """Opens the ortho at the given downsample factor, 0 (or 1) means the full resolution.
+    The downsample factor should be one of the overviews of the ortho, like the values of `OrthoView.overview_level`.
+    """
+    if downsample in (0, 1):
+        return rasterio.open(ortho_path)
+
+    with rasterio.open(ortho_path) as src:
+        overviews = src.overviews(1)
+    if downsample not in overviews:
+        raise ValueError(
+            f"Downsample factor {downsample} not available in {ortho_path}, available: {overviews}"
+        )
+    return rasterio.open(ortho_path, overview_level=overviews.index(downsample))
+
+
+def read_window(src: rasterio.DatasetReader, window: Window) -> np.ndarray:
+    """Reads a window of all bands, the parts of the window outside the ortho are filled with zeros.
+    This avoids the `boundless=True` option of rasterio, which goes through a (slow) VRT.
+    """
+    window = window.round_offsets().round_lengths()
+    out = np.zeros((src.count, window.height, window.width), dtype=src.dtypes[0])
+    col_start = max(0, window.col_off)
+    row_start = max(0, window.row_off)
+    col_stop = min(src.width, window.col_off + window.width)
+    row_stop = min(src.height, window.row_off + window.height)
+    if col_start >= col_stop or row_start >= row_stop:
+        # Window completely outside the ortho
+        return out
+
+    out[
+        :,
+        row_start - window.row_off : row_stop - window.row_off,
+        col_start - window.col_off : col_stop - window.col_off,
+    ] = src.read(
+        window=Window.from_slices((row_start, row_stop), (col_start, col_stop))
+    )
+    return out
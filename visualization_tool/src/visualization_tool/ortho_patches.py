@@ -0,0 +1,232 @@
+"""
+Extracts fixed size ortho patches centered on the image positions, to build training datasets.
+
+The patches are read with windowed reads, so the ortho is never loaded completely in memory.
+The windows are sorted by the internal tiles of the ortho and split in shards, every shard is
+read and written by a worker of a process pool. The memory usage is thus bounded by
+(number of workers) x (shard size) x (patch size), regardless of the size of the ortho.
+
+Every shard is written as a NPZ file with the arrays:
+    - patches: uint8 array of shape (n, bands, patch_size, patch_size)
+    - ids: the image ids in the database
+    - labels: the image labels
+An index.csv file maps every image to its shard and position in the shard.
+
+Usage:
+    python -m visualization_tool.ortho_patches OUTPUT_DIR --site Muziekbos-block --patch-size 512
+"""
+
+import argparse
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import rasterio
+from rasterio.transform import rowcol
+from rasterio.warp import transform as warp_transform
+from rasterio.windows import Window
+from tqdm.auto import tqdm
+
+import visualization_tool.database.database as db
+from visualization_tool.config import DATA_PATH
+from visualization_tool.ortho_io import find_ortho, open_ortho, read_window
+
+# Opened orthos per worker process, so that every shard doesn't reopen the ortho
+_datasets: dict[tuple[Path, int], rasterio.DatasetReader] = {}
+
+
+def select_images(
+    study_site: str | None = None,
+    date: str | None = None,
+    camera: str | None = None,
+    bbox: tuple[float, float, float, float] | None = None,
+) -> pd.DataFrame:
+    """Returns the images with a known position matching the filters as a DataFrame."""
+    df = pd.DataFrame(
+        db.select_images(study_site, date, camera, bbox),
+        columns=db.SELECT_IMAGES_COLUMNS,
+    )
+    return df.dropna(subset=["x", "y"])
+
+
+def extract_patches(
+    images: pd.DataFrame,
+    output_dir: Path,
+    patch_size: int = 256,
+    downsample: int = 0,
+    shard_size: int = 512,
+    max_workers: int | None = None,
+) -> pd.DataFrame:
+    """Extracts patches of `patch_size` x `patch_size` pixels around the positions of the images.
+    `images` is a DataFrame as returned by `select_images`, `downsample` is the overview factor of the ortho
+    to read from (0 is full resolution). Returns the index of the written patches.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tasks = []
+    for flight_path, flight_images in images.groupby("flight_path"):
+        ortho_path = find_ortho(DATA_PATH.joinpath(flight_path))
+        if ortho_path is None:
+            print(
+                f"\033[93m\n Warning: No ortho found in {flight_path}, skipping {len(flight_images)} images \033[0m"
+            )
+            continue
+        try:
+            shards = _plan_shards(
+                ortho_path,
+                flight_images,
+                output_dir,
+                patch_size,
+                downsample,
+                shard_size,
+            )
+        except ValueError as e:
+            # The ortho doesn't have the requested overview
+            print(
+                f"\033[93m\n Warning: {e}, skipping {len(flight_images)} images of {flight_path} \033[0m"
+            )
+            continue
+        tasks.extend(shards)
+
+    index = []
+    max_workers = max_workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(_extract_shard, *task) for task in tasks]
+        for future in tqdm(
+            as_completed(futures), total=len(futures), desc="Extracting patches"
+        ):
+            index.append(future.result())
+
+    index = (
+        pd.concat(index, ignore_index=True)
+        if index != []
+        else pd.DataFrame(columns=["id", "label", "shard", "position"])
+    )
+    index.to_csv(output_dir / "index.csv", index=False)
+    return index
+
+
+def _plan_shards(
+    ortho_path: Path,
+    images: pd.DataFrame,
+    output_dir: Path,
+    patch_size: int,
+    downsample: int,
+    shard_size: int,
+) -> list[tuple]:
+    """Computes the windows of the patches and groups them in shards ordered by the internal tiles of the ortho."""
+    with open_ortho(ortho_path, downsample) as src:
+        xs, ys = images.x.to_numpy(), images.y.to_numpy()
+        if src.crs != "EPSG:3812":
+            xs, ys = warp_transform("EPSG:3812", src.crs, xs, ys)
+        rows, cols = rowcol(src.transform, xs, ys)
+        block_h, block_w = src.block_shapes[0]
+
+    windows = pd.DataFrame(
+        {
+            "id": images.id.to_numpy(),
+            "label": images.label.to_numpy(),
+            "row_off": np.asarray(rows) - patch_size // 2,
+            "col_off": np.asarray(cols) - patch_size // 2,
+        }
+    )
+    # Sorting the windows by the tile they start in, so consecutive reads hit the same or neighbouring tiles
+    windows["block_row"] = windows.row_off.clip(lower=0) // block_h
+    windows["block_col"] = windows.col_off.clip(lower=0) // block_w
+    windows = windows.sort_values(["block_row", "block_col", "row_off", "col_off"])
+
+    name = ortho_path.parent.relative_to(DATA_PATH).as_posix().replace("/", "_")
+    n_shards = math.ceil(len(windows) / shard_size)
+    return [
+        (
+            ortho_path,
+            downsample,
+            patch_size,
+            windows.iloc[i * shard_size : (i + 1) * shard_size][
+                ["id", "label", "row_off", "col_off"]
+            ],
+            output_dir / f"{name}_{i:05d}.npz",
+        )
+        for i in range(n_shards)
+    ]
+
+
+def _extract_shard(
+    ortho_path: Path,
+    downsample: int,
+    patch_size: int,
+    windows: pd.DataFrame,
+    shard_path: Path,
+) -> pd.DataFrame:
+    """Reads all windows of a shard and writes them to `shard_path`, runs in a worker process."""
+    key = (ortho_path, downsample)
+    if key not in _datasets:
+        _datasets[key] = open_ortho(ortho_path, downsample)
+    src = _datasets[key]
+
+    patches = np.empty(
+        (len(windows), src.count, patch_size, patch_size), dtype=src.dtypes[0]
+    )
+    for i, (row_off, col_off) in enumerate(
+        zip(windows.row_off, windows.col_off, strict=True)
+    ):
+        patches[i] = read_window(
+            src, Window(int(col_off), int(row_off), patch_size, patch_size)
+        )
+
+    np.savez(
+        shard_path,
+        patches=patches,
+        ids=windows.id.to_numpy(),
+        labels=windows.label.to_numpy(dtype=str),
+    )
+    return pd.DataFrame(
+        {
+            "id": windows.id.to_numpy(),
+            "label": windows.label.to_numpy(),
+            "shard": shard_path.name,
+            "position": np.arange(len(windows)),
+        }
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Extract ortho patches centered on the image positions."
+    )
+    parser.add_argument("output_dir", type=Path)
+    parser.add_argument("--site", help="Study site, like Muziekbos-block")
+    parser.add_argument("--date", help="Flight date, like 20220428")
+    parser.add_argument("--camera", help="Camera name, like sony")
+    parser.add_argument(
+        "--bbox",
+        type=float,
+        nargs=4,
+        metavar=("XMIN", "YMIN", "XMAX", "YMAX"),
+        help="Bounding box in EPSG:3812",
+    )
+    parser.add_argument("--patch-size", type=int, default=256)
+    parser.add_argument(
+        "--downsample",
+        type=int,
+        default=0,
+        help="Overview factor of the ortho, 0 is full resolution",
+    )
+    parser.add_argument("--shard-size", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    selected = select_images(
+        args.site, args.date, args.camera, tuple(args.bbox) if args.bbox else None
+    )
+    print(f"Selected {len(selected)} images with a known position")
+    extract_patches(
+        selected,
+        args.output_dir,
+        patch_size=args.patch_size,
+        downsample=args.downsample,
+        shard_size=args.shard_size,
+        max_workers=args.workers,
+    )
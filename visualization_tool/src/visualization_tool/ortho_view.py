@@ -8,8 +8,18 @@ import rasterio
 import rioxarray
 import xarray
 from holoviews.operation.datashader import rasterize
-
+from panel.io.state import set_curdoc
+
+from .derived_layers import (
+    LAYERS,
+    colorize,
+    compute_layer_async,
+    find_layer,
+    open_layer,
+)
 from .flight import Flight
+from .ortho_io import find_ortho
+from .shared_cache import content_key, shared_cache
 
 
 class OrthoView(param.Parameterized):
@@ -17,6 +27,7 @@ class OrthoView(param.Parameterized):
         class_=Flight, constant=True, precedence=-1, instantiate=False
     )
     overview_level = param.Selector(objects=[], label="Downsample")
+    layer = param.Selector(objects=["RGB", *LAYERS], default="RGB")
     ortho_path = param.ClassSelector(class_=Path, precedence=-1)
     ortho_xmin = param.Number(precedence=-1)
     ortho_ymin = param.Number(precedence=-1)
@@ -33,9 +44,9 @@ class OrthoView(param.Parameterized):
             self.update_ortho_view,
         )
 
-    @param.depends("overview_level", watch=True)
+    @param.depends("overview_level", "layer", watch=True)
     def overview_level_updated(self):
-        # When overview level parameter is updated, we need to reload the ortho but only if it was directly changed by the user.
+        # When overview level or layer parameter is updated, we need to reload the ortho but only if it was directly changed by the user.
         if not self.supress_update:
             self.update_ortho = not self.update_ortho
 
@@ -45,16 +56,12 @@ class OrthoView(param.Parameterized):
         #   - Find the ortho in the flight folder
         #   - Update the path
         #   - Get the overview levels and update the selector
-        r = list(self.flight.flight_folder.glob("Ortho*.tif"))
-        if len(r) > 1:
-            print(
-                "\033[93m\n Warning: More than one ortho found in flight folder, the first one will be selected\033[0m"
-            )
-        if r != []:
+        ortho_path = find_ortho(self.flight.flight_folder)
+        if ortho_path is not None:
             # Supress orth updates, due to a change in the overview level
             self.supress_update = True
             # Ortho found
-            self.ortho_path = r[0]
+            self.ortho_path = ortho_path
             src = rasterio.open(self.ortho_path, "r")
             # Check if the ortho has overviews
             self.param.overview_level.objects = [0, *src.overviews(1)]
@@ -68,8 +75,26 @@ class OrthoView(param.Parameterized):
 
         self.update_ortho = not self.update_ortho
 
-    def load_ortho(self) -> xarray.DataArray:
-        if self.overview_level == 0:
+    def load_ortho(self, layer: str = "RGB") -> xarray.DataArray:
+        """Loads the ortho or a computed layer at the selected overview level in EPSG:3812.
+        The loaded arrays are shared with the other processes serving the app.
+        """
+        arrays = shared_cache.get_or_load(
+            content_key(self.ortho_path, "ortho", self.overview_level, layer),
+            lambda: self.read_ortho(layer),
+        )
+        ortho = xarray.DataArray(
+            arrays["data"],
+            dims=("band", "y", "x"),
+            coords={"band": arrays["band"], "y": arrays["y"], "x": arrays["x"]},
+        )
+        return ortho.rio.write_crs(str(arrays["crs"]))
+
+    def read_ortho(self, layer: str = "RGB") -> dict[str, np.ndarray]:
+        if layer != "RGB":
+            # Only called once the layer is computed, see update_ortho_view
+            ortho = open_layer(*find_layer(self.ortho_path, layer, self.overview_level))
+        elif self.overview_level == 0:
             # Equivalent to "no overview", loading the highest resolution
             ortho = rioxarray.open_rasterio(self.ortho_path)
         else:
@@ -78,7 +103,30 @@ class OrthoView(param.Parameterized):
         assert type(ortho) is xarray.DataArray, (
             "Ortho is not an xarray.DataArray, wrong ortho loaded?"
         )
-        return ortho
+
+        print(
+            "Ortho crs: ",
+            ortho.rio.crs,
+        )
+        if ortho.rio.crs != "EPSG:3812":
+            ortho = ortho.rio.reproject("EPSG:3812")
+            print("reprojected crs: ", ortho.rio.crs)
+
+        if layer != "RGB":
+            # Showing the layer with a colormap, as RGBA like the ortho itself
+            data = colorize(ortho.values[0], layer)
+            band = np.arange(1, 5)
+        else:
+            data = ortho.values
+            band = ortho.band.values
+
+        return {
+            "data": data,
+            "band": band,
+            "y": ortho.y.values,
+            "x": ortho.x.values,
+            "crs": np.array(ortho.rio.crs.to_string()),
+        }
 
     ### ORTHO IMAGE
     @pn.depends("update_ortho")
@@ -88,15 +136,17 @@ class OrthoView(param.Parameterized):
             # Hardcoded bounds to 100 so that initial scale will contain ortho, see framewise issue below
             return hv.RGB(np.zeros((2, 2, 3)), bounds=(0, 0, 100, 100))
 
-        ortho = self.load_ortho()
-
-        print(
-            "Ortho crs: ",
-            ortho.rio.crs,
-        )
-        if ortho.rio.crs != "EPSG:3812":
-            ortho = ortho.rio.reproject("EPSG:3812")
-            print("reprojected crs: ", ortho.rio.crs)
+        layer = self.layer
+        title = f"{self.flight.study_site} {self.flight.date}"
+        if (
+            layer != "RGB"
+            and find_layer(self.ortho_path, layer, self.overview_level) is None
+        ):
+            # Computing the layer can take minutes, the ortho is shown until it is done
+            self.compute_layer(layer)
+            title += f", computing {layer}..."
+            layer = "RGB"
+        ortho = self.load_ortho(layer)
 
         self.ortho_gsd = ortho.rio.resolution()[0]
         print("Ortho GSD (mm/px): ", self.ortho_gsd * 1000)
@@ -115,9 +165,29 @@ class OrthoView(param.Parameterized):
             ),
             vdims=list("RGB"),
         ).opts(
-            title=f"{self.flight.study_site} {self.flight.date}, GSD: {self.ortho_gsd * 1000:.2f}mm/px",
+            title=f"{title}, GSD: {self.ortho_gsd * 1000:.2f}mm/px",
         )
 
+    def compute_layer(self, layer: str):
+        """Computes the layer in the background, the view of this session is updated when it is done."""
+        future = compute_layer_async(self.ortho_path, layer, self.overview_level)
+        doc = pn.state.curdoc
+
+        def done(future):
+            if future.exception() is not None:
+                print(
+                    f"\033[91m Failed to compute {layer} layer: {future.exception()!r} \033[0m"
+                )
+                return
+            # Schedules the update on the event loop of the session
+            with set_curdoc(doc):
+                pn.state.execute(self.layer_computed)
+
+        future.add_done_callback(done)
+
+    def layer_computed(self):
+        self.update_ortho = not self.update_ortho
+
     @property
     def view(self):
         # Framewise issue:
@@ -0,0 +1,154 @@
+"""
+Cache of decoded arrays shared between processes, e.g. the workers of `panel serve --num-procs`.
+
+Every entry is a folder with one .npy file per array and a manifest listing them, stored in `SHARED_CACHE_PATH` (by default in
+/dev/shm, which lives in RAM). Entries are read with a memory map, so all processes share the same
+physical memory instead of each holding their own decoded copy.
+Entries are written to a temporary folder and renamed, so readers never see a partial entry.
+The least recently used entries are evicted when the cache grows above `SHARED_CACHE_SIZE` or the
+free space of the file system.
+"""
+
+import hashlib
+import os
+import shutil
+import uuid
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+
+from visualization_tool.config import SHARED_CACHE_PATH, SHARED_CACHE_SIZE
+from visualization_tool.file_lock import file_lock
+
+# File listing the arrays of an entry
+_MANIFEST = "arrays.txt"
+
+
+def content_key(path: Path, *params) -> str:
+    """Key of the data decoded from `path` with `params`, changes when the file changes."""
+    stat = path.stat()
+    h = hashlib.sha1(
+        repr(
+            (path.resolve().as_posix(), stat.st_size, stat.st_mtime_ns, params)
+        ).encode()
+    )
+    return h.hexdigest()
+
+
+class SharedArrayCache:
+    def __init__(
+        self, path: Path = SHARED_CACHE_PATH, max_bytes: int = SHARED_CACHE_SIZE
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock_path = self.path / ".lock"
+
+    def get(self, key: str) -> dict[str, np.ndarray] | None:
+        """Returns the (read-only, memory mapped) arrays stored under `key`, None if not cached."""
+        entry = self.path / key
+        try:
+            # The manifest lists the arrays of the entry, an entry that is being evicted by another
+            # process can miss some of its arrays and is treated as not cached
+            names = (entry / _MANIFEST).read_text().split()
+            # np.asarray gives plain ndarray views on the memory maps (still zero-copy),
+            # holoviews rejects np.memmap coordinates
+            arrays = {
+                name: np.asarray(
+                    np.load(entry / f"{name}.npy", mmap_mode="r", allow_pickle=False)
+                )
+                for name in names
+            }
+            # Updating the modification time marks the entry as recently used
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return arrays
+
+    def put(self, key: str, arrays: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        """Stores the arrays under `key` and returns the memory mapped cached arrays.
+        Arrays that don't fit in the cache are returned as is, without caching them.
+        """
+        size = sum(a.nbytes for a in arrays.values())
+        if size > self.max_bytes:
+            return arrays
+        with self._lock():
+            if not self._make_room(size):
+                return arrays
+
+        tmp = self.path / f".tmp-{uuid.uuid4().hex}"
+        try:
+            tmp.mkdir()
+            for name, array in arrays.items():
+                # np.asarray keeps 0-d arrays (e.g. the crs of an ortho) 0-d
+                np.save(tmp / f"{name}.npy", np.asarray(array))
+            (tmp / _MANIFEST).write_text("\n".join(arrays))
+        except OSError as e:
+            # E.g. the shared memory got full because other processes wrote to it in the meantime
+            print(f"\033[93m Warning: Failed to cache {key}: {e} \033[0m")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return arrays
+
+        with self._lock():
+            try:
+                tmp.rename(self.path / key)
+            except OSError:
+                # Another process stored the same entry in the meantime
+                shutil.rmtree(tmp, ignore_errors=True)
+
+        cached = self.get(key)
+        return cached if cached is not None else arrays
+
+    def get_or_load(
+        self, key: str, loader: Callable[[], dict[str, np.ndarray]]
+    ) -> dict[str, np.ndarray]:
+        """Returns the cached arrays of `key`, loading and storing them with `loader` on a miss."""
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = self.put(key, loader())
+        return arrays
+
+    def clear(self):
+        with self._lock():
+            for entry in self.path.iterdir():
+                if entry.is_dir():
+                    shutil.rmtree(entry, ignore_errors=True)
+
+    def _make_room(self, size: int) -> bool:
+        """Evicts the least recently used entries until an entry of `size` bytes fits, returns False if it can't fit.
+        The cache is limited to `max_bytes` and to the free space of the file system, /dev/shm is often much
+        smaller than the cache size (e.g. 64 MB in a Docker container).
+        Processes that still have an evicted entry memory mapped keep it until they release it.
+        """
+        entries = []
+        total = 0
+        for entry in self.path.iterdir():
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            try:
+                entry_size = sum(f.stat().st_size for f in entry.iterdir())
+                entries.append((entry.stat().st_mtime, entry_size, entry))
+            except FileNotFoundError:
+                continue
+            total += entry_size
+
+        budget = min(self.max_bytes, total + shutil.disk_usage(self.path).free)
+        if size > budget:
+            return False
+
+        entries.sort()
+        for _, entry_size, entry in entries:
+            if total + size <= budget:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= entry_size
+        return True
+
+    def _lock(self):
+        # Without file locks (Windows), the atomic renames still keep the cache consistent
+        return file_lock(self._lock_path)
+
+
+# One cache per process, all processes use the same folder
+shared_cache = SharedArrayCache()